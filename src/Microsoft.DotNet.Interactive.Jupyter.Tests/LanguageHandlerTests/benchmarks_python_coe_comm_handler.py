@@ -0,0 +1,307 @@
+﻿# Copyright (c) .NET Foundation and contributors. All rights reserved.
+# Licensed under the MIT license. See LICENSE file in the project root for full license information.
+
+# Run this benchmark using:
+#       > ipython benchmarks_python_coe_comm_handler.py
+# Options are passed after "--":
+#       > ipython benchmarks_python_coe_comm_handler.py -- --large --update-baseline
+#
+# Every scenario runs with each json backend the envelope encoder can use, json and orjson when it is
+# installed, unless --backend picks one. The to_dict scenarios time json.dumps(df.to_dict('records')),
+# the encoding RequestValue used before the encoder registry, next to them.
+# Results are compared with benchmarks_python_coe_comm_handler.baseline.json when it exists, a scenario
+# whose p50 latency or peak memory grows past the tolerance makes the run fail. Baselines depend on the
+# machine, record them with --update-baseline on the machine the benchmark is compared on. The baseline
+# keeps the machine it was recorded on and no baseline is checked in. Regression runs pass --check,
+# which fails when there is no baseline to compare with instead of only reporting the results.
+# Peak memory is measured with tracemalloc, which does not see buffers allocated by pyarrow.
+# RequestValue and RequestValueInfos scenarios rebind their variables to new objects before every sample
+# so they measure encoding and summarizing, the -cached scenarios keep them bound and measure answers from
+# the handler's response and value info caches. Scenarios take at least 5 samples, p99 is only reported
+# for the ones with enough samples to have one.
+
+import sys
+sys.path.append('../../Microsoft.DotNet.Interactive.Jupyter/CommandEvents/LanguageHandlers/python')
+
+import argparse
+import copy
+import json
+import math
+import os
+import platform
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from coe_comm_handler import __get_dotnet_coe_comm_handler as get_dotnet_coe_comm_handler
+import coe_comm_handler
+
+baseline_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks_python_coe_comm_handler.baseline.json')
+
+class benchmarkComm:
+    __msg_handler = None
+    # message sent back to the comm channel
+    msg_sent = None
+    # binary buffers sent back along with the message
+    buffers_sent = None
+    def handle_msg(self, msg):
+        self.__msg_handler(msg)
+
+    def on_msg(self, handler):
+        self.__msg_handler = handler
+
+    def on_close(self, handler):
+        pass
+
+    def send(self, msg, buffers = None):
+        self.msg_sent = msg
+        self.buffers_sent = buffers
+
+def create_msg_received(commandType, command = {}):
+    return {
+        "content": {
+            "data": {
+                'type': 'command',
+                'commandOrEvent': json.dumps({
+                    "token": "1",
+                    "commandType": commandType,
+                    "command": command
+                })
+            }
+        }
+    }
+
+def open_comm(backend):
+    # the encoder picks its backend on first use, which is the ready event sent on open
+    orjson = sys.modules.get('orjson')
+    if (backend == 'json'):
+        sys.modules['orjson'] = None
+    try:
+        comm = benchmarkComm()
+        get_dotnet_coe_comm_handler().handle_control_comm_opened(comm, 'benchmark_target')
+        return comm
+    finally:
+        if (backend == 'json'):
+            if (orjson is None):
+                del sys.modules['orjson']
+            else:
+                sys.modules['orjson'] = orjson
+
+def set_variables(variables):
+    # the handler reads values from its own globals and names from the ipython namespace
+    for name, value in variables.items():
+        setattr(coe_comm_handler, name, value)
+        get_ipython().user_ns[name] = value
+
+def rebind_variables(variables):
+    # a new object under the same name is never answered from the response cache
+    for name, value in variables.items():
+        rebound = value.copy(deep=False) if isinstance(value, (pd.DataFrame, pd.Series)) else copy.copy(value)
+        setattr(coe_comm_handler, name, rebound)
+        get_ipython().user_ns[name] = rebound
+
+def remove_variables(variables):
+    for name in variables:
+        delattr(coe_comm_handler, name)
+        get_ipython().user_ns.pop(name, None)
+
+def available_backends():
+    try:
+        import orjson
+        return ['json', 'orjson']
+    except ImportError:
+        return ['json']
+
+def payload_size(msg_received, comm):
+    # bytes crossing the comm in both directions, send value moves its payload in the request
+    received = len(msg_received['content']['data']['commandOrEvent'])
+    return received + len(comm.msg_sent['commandOrEvent'] or '') + sum(memoryview(buffer).nbytes for buffer in comm.buffers_sent or [])
+
+def round_trip(comm, scenario, msg_received):
+    comm.handle_msg(msg_received)
+    event = json.loads(comm.msg_sent['commandOrEvent'])
+    if (event['eventType'] == 'CommandFailed'):
+        raise RuntimeError(f'{scenario}: {event["event"]["message"]}')
+    return payload_size(msg_received, comm)
+
+def to_dict_records(name):
+    # the encoding RequestValue used before the encoder registry, timestamps are written as text
+    return len(json.dumps(getattr(coe_comm_handler, name).to_dict('records'), default=str))
+
+def percentile(samples, p):
+    # None when there are too few samples for the percentile to be more than their maximum
+    if (len(samples) * (1 - p) < 1 and p > 0.5):
+        return None
+    ordered = sorted(samples)
+    return ordered[max(math.ceil(len(ordered) * p), 1) - 1]
+
+def run_scenario(run, rows, repeat, prepare):
+    # run sends one request and returns the bytes it moved
+    run()
+
+    samples = []
+    for _ in range(repeat):
+        prepare()
+        start = time.perf_counter()
+        size = run()
+        samples.append(time.perf_counter() - start)
+
+    prepare()
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    p50 = percentile(samples, 0.5)
+    p99 = percentile(samples, 0.99)
+    return {
+        'samples': len(samples),
+        'p50_ms': p50 * 1000,
+        'p99_ms': None if p99 is None else p99 * 1000,
+        'rows_per_s': rows / p50,
+        'mb_per_s': size / p50 / 2**20,
+        'peak_mb': peak / 2**20
+    }
+
+def repeat_for(rows):
+    return max(5, min(100, 1_000_000 // max(rows, 1)))
+
+def long_dataframe(rows):
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        "id": np.arange(rows),
+        "value": rng.random(rows),
+        "flag": rng.random(rows) > 0.5,
+        "category": rng.choice(["red", "green", "blue"], rows),
+        "at": pd.Timestamp("2024-01-01") + pd.to_timedelta(np.arange(rows), unit="s")
+    })
+
+def wide_dataframe(rows, columns):
+    rng = np.random.default_rng(0)
+    return pd.DataFrame(rng.random((rows, columns)), columns=[f'c{i}' for i in range(columns)])
+
+def nested_json(items):
+    return [{
+        "id": i,
+        "name": f"item {i}",
+        "tags": ["a", "b", "c"],
+        "position": {"x": i * 0.5, "y": -i, "history": [{"step": s, "value": s * i} for s in range(3)]}
+    } for i in range(items)]
+
+def namespace(count):
+    rng = np.random.default_rng(0)
+    variables = {}
+    for i in range(count):
+        kind = i % 5
+        if (kind == 0):
+            variables[f'bench_ns_{i}'] = i
+        elif (kind == 1):
+            variables[f'bench_ns_{i}'] = f'value {i}' * 10
+        elif (kind == 2):
+            variables[f'bench_ns_{i}'] = list(range(1000))
+        elif (kind == 3):
+            variables[f'bench_ns_{i}'] = rng.random((100, 10))
+        else:
+            variables[f'bench_ns_{i}'] = wide_dataframe(1000, 10)
+    return variables
+
+def scenarios(large):
+    sizes = [1_000, 100_000, 1_000_000] + ([10_000_000] if large else [])
+    for rows in sizes:
+        df = long_dataframe(rows)
+        yield (f'RequestValue/dataframe/{rows}', { 'bench_df': df }, create_msg_received("RequestValue", {"name": "bench_df", "mimeType": "application/json"}), rows, True)
+        yield (f'RequestValue/to_dict/{rows}', { 'bench_df': df }, 'bench_df', rows, False)
+        yield (f'RequestValue/dataframe-cached/{rows}', { 'bench_df': df }, create_msg_received("RequestValue", {"name": "bench_df", "mimeType": "application/json"}), rows, False)
+        yield (f'RequestValue/arrow/{rows}', { 'bench_df': df }, create_msg_received("RequestValue", {"name": "bench_df", "mimeType": "application/vnd.apache.arrow.stream"}), rows, True)
+        # send value receives the table the .net side writes, which matches pandas' table orientation
+        table = df.to_json(orient='table', index=False, date_format='iso')
+        yield (f'SendValue/dataframe/{rows}', {}, create_msg_received("SendValue", {"name": "bench_df_sent", "formattedValue": {"mimeType": "application/table-schema+json", "value": table}}), rows, False)
+
+    wide = wide_dataframe(1000, 1000)
+    yield ('RequestValue/wide/1000x1000', { 'bench_df': wide }, create_msg_received("RequestValue", {"name": "bench_df", "mimeType": "application/json"}), len(wide), True)
+    yield ('RequestValue/to_dict-wide/1000x1000', { 'bench_df': wide }, 'bench_df', len(wide), False)
+    yield ('SendValue/wide/1000x1000', {}, create_msg_received("SendValue", {"name": "bench_df_sent", "formattedValue": {"mimeType": "application/table-schema+json", "value": wide.to_json(orient='table', index=False)}}), len(wide), False)
+
+    nested = nested_json(100_000)
+    yield ('RequestValue/nested/100000', { 'bench_nested': nested }, create_msg_received("RequestValue", {"name": "bench_nested", "mimeType": "application/json"}), len(nested), True)
+    yield ('SendValue/nested/100000', {}, create_msg_received("SendValue", {"name": "bench_nested_sent", "formattedValue": {"mimeType": "application/json", "value": json.dumps(nested)}}), len(nested), False)
+
+    for count in [100, 500]:
+        variables = namespace(count)
+        yield (f'RequestValueInfos/namespace/{count}', variables, create_msg_received("RequestValueInfos"), count, True)
+        yield (f'RequestValueInfos/namespace-cached/{count}', variables, create_msg_received("RequestValueInfos"), count, False)
+
+def machine():
+    return { 'node': platform.node(), 'processor': platform.processor() or platform.machine(), 'python': platform.python_version(), 'cpus': os.cpu_count() }
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for scenario, result in results.items():
+        if (scenario not in baseline):
+            continue
+        for metric in ['p50_ms', 'peak_mb']:
+            limit = baseline[scenario][metric] * (1 + tolerance)
+            if (result[metric] > limit):
+                regressions.append(f'{scenario} {metric}: {result[metric]:.1f} > {limit:.1f} (baseline {baseline[scenario][metric]:.1f})')
+    return regressions
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--large', action='store_true', help='include 10,000,000 row dataframes')
+    parser.add_argument('--backend', choices=['json', 'orjson'], help='json backend of the envelope encoder, every installed one is run when omitted')
+    parser.add_argument('--filter', default='', help='only run scenarios whose name contains this text')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed growth over the baseline, 0.25 is 25%%')
+    parser.add_argument('--update-baseline', action='store_true', help='write the results as the new baseline')
+    parser.add_argument('--check', action='store_true', help='fail when there is no baseline to compare with')
+    args = parser.parse_args(argv)
+
+    comms = { backend: open_comm(backend) for backend in ([args.backend] if args.backend else available_backends()) }
+    results = {}
+    print(f'{"scenario":<48} {"samples":>7} {"p50":>10} {"p99":>10} {"rows/s":>14} {"MB/s":>8} {"peak MB":>9}')
+    for scenario, variables, request, rows, rebind in scenarios(args.large):
+        if (args.filter not in scenario):
+            continue
+        # the to_dict scenarios do not go through the handler, they are written by json
+        runs = { 'json': lambda: to_dict_records(request) } if isinstance(request, str) else \
+            { backend: (lambda comm=comm: round_trip(comm, scenario, request)) for backend, comm in comms.items() }
+        set_variables(variables)
+        prepare = (lambda: rebind_variables(variables)) if rebind else (lambda: None)
+        try:
+            for backend, run in runs.items():
+                name = f'{scenario} [{backend}]'
+                result = results[name] = run_scenario(run, rows, repeat_for(rows), prepare)
+                p99 = 'n/a' if result['p99_ms'] is None else f'{result["p99_ms"]:.1f} ms'
+                print(f'{name:<48} {result["samples"]:>7} {result["p50_ms"]:>7.1f} ms {p99:>10} {result["rows_per_s"]:>14,.0f} {result["mb_per_s"]:>8.1f} {result["peak_mb"]:>9.1f}')
+        finally:
+            remove_variables(variables)
+
+    if (args.update_baseline):
+        baseline = {}
+        if (os.path.exists(baseline_path)):
+            with open(baseline_path) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        baseline['machine'] = machine()
+        with open(baseline_path, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f'baseline written to {baseline_path}')
+        return 0
+
+    if (not os.path.exists(baseline_path)):
+        print('no baseline found, run with --update-baseline to record one')
+        return 1 if args.check else 0
+
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    if (baseline.get('machine') != machine()):
+        print(f'WARNING baseline was recorded on {baseline.get("machine")}, latencies are not comparable across machines')
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f'REGRESSION {regression}')
+    return 1 if regressions else 0
+
+exitCode = main(sys.argv[1:])
+if (exitCode != 0):
+    sys.exit(exitCode)
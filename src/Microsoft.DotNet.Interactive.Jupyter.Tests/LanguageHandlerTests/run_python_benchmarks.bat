@@ -0,0 +1,7 @@
+@ECHO OFF
+REM this script needs to be run in a conda environment where ipython is installed
+
+REM run python benchmarks using ipython 
+REM options such as --update-baseline or --check are passed through
+ipython ./benchmarks_python_coe_comm_handler.py -- %*
+
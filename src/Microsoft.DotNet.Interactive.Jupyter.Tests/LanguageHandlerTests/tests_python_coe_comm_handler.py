@@ -8,6 +8,7 @@ import sys
 sys.path.append('../../Microsoft.DotNet.Interactive.Jupyter/CommandEvents/LanguageHandlers/python')
 
 import json
+import time
 import unittest
 from coe_comm_handler import __get_dotnet_coe_comm_handler as get_dotnet_coe_comm_handler
 import coe_comm_handler
@@ -16,14 +17,29 @@ class testComm:
     __msg_handler = None
     # message sent back to the comm channel
     msg_sent = None
+    # binary buffers sent back along with the message
+    buffers_sent = None
+    # all messages sent back to the comm channel
+    msgs_sent = None
+    def __init__(self):
+        self.msgs_sent = []
+
     def handle_msg(self, msg):
         self.__msg_handler(msg)
         
     def on_msg(self, handler):
         self.__msg_handler = handler
     
-    def send(self, msg):
+    def on_close(self, handler):
+        self.__close_handler = handler
+    
+    def close(self):
+        self.__close_handler({})
+    
+    def send(self, msg, buffers = None):
         self.msg_sent = msg
+        self.buffers_sent = buffers
+        self.msgs_sent.append(msg)
 
 class TestCoeCommHandler(unittest.TestCase):
 
@@ -71,13 +87,63 @@ class TestCoeCommHandler(unittest.TestCase):
         
         return msg
         
+    @staticmethod
+    def decode_msg(msg):
+        # the payload is compared as decoded json, the encoder in use decides about whitespace
+        return dict(msg, commandOrEvent=json.loads(msg["commandOrEvent"]))
+    
+    def assertMsgEqual(self, msg_sent, msg_expected):
+        self.assertEqual(self.decode_msg(msg_sent), self.decode_msg(msg_expected))
+    
+    def assertMsgIn(self, msg_expected, msgs_sent):
+        self.assertIn(self.decode_msg(msg_expected), [self.decode_msg(msg) for msg in msgs_sent])
+        
     def setUp(self):
         self.comm = testComm()
         self.handler = get_dotnet_coe_comm_handler()
         self.handler.handle_control_comm_opened(self.comm, 'test_target')
         
     def test_can_get_kernel_ready_on_comm_open(self):
-        self.assertEqual(self.comm.msg_sent, self.create_msg_sent("KernelReady", { "kernelInfos": [] }))
+        self.assertMsgEqual(self.comm.msg_sent, self.create_msg_sent("KernelReady", { "kernelInfos": [] }))
+    
+    def test_can_get_kernel_ready_on_comm_open_with_invalid_max_concurrency(self):
+        for maxConcurrency in [-1, 0, "4", 1.5, True]:
+            comm = testComm()
+            handler = get_dotnet_coe_comm_handler()
+            handler.handle_control_comm_opened(comm, {"content": {"data": {"executionMode": "async", "maxConcurrency": maxConcurrency}}})
+            comm.close()
+            self.assertMsgEqual(comm.msg_sent, self.create_msg_sent("KernelReady", { "kernelInfos": [] }))
+    
+    def test_can_negotiate_compression_on_comm_open(self):
+        comm = testComm()
+        handler = get_dotnet_coe_comm_handler()
+        handler.handle_control_comm_opened(comm, {"content": {"data": {"compression": ["unknown", "zlib", "gzip"], "compressionThreshold": 1024}}})
+        self.assertMsgEqual(comm.msg_sent, self.create_msg_sent("KernelReady", {
+            "kernelInfos": [],
+            "capabilities": { "compression": "zlib", "compressionThreshold": 1024 }
+        }))
+        
+        import zlib
+        coe_comm_handler.x = list(range(1000))
+        msg_received = self.create_msg_received("RequestValue", {"name": "x", "mimeType": "application/json"});
+        comm.handle_msg(msg_received)
+        self.assertEqual(comm.msg_sent["compression"], { "codec": "zlib", "bufferIndex": 0 })
+        self.assertIsNone(comm.msg_sent["commandOrEvent"])
+        event = json.loads(zlib.decompress(comm.buffers_sent[0]))
+        self.assertEqual(event["eventType"], "ValueProduced")
+        self.assertEqual(event["event"]["value"], coe_comm_handler.x)
+        
+        # small payloads are sent as they are
+        coe_comm_handler.x = "test"
+        comm.handle_msg(msg_received)
+        self.assertNotIn("compression", comm.msg_sent)
+        self.assertIsNone(comm.buffers_sent)
+    
+    def test_can_open_without_compression_when_no_codec_is_supported(self):
+        comm = testComm()
+        handler = get_dotnet_coe_comm_handler()
+        handler.handle_control_comm_opened(comm, {"content": {"data": {"compression": ["unknown"]}}})
+        self.assertMsgEqual(comm.msg_sent, self.create_msg_sent("KernelReady", { "kernelInfos": [], "capabilities": {} }))
     
     def test_can_handle_invalid_json(self):
         msg_received = {"content": { "data": {'type': 'command', 'commandOrEvent': 'just a string'}}};
@@ -86,7 +152,7 @@ class TestCoeCommHandler(unittest.TestCase):
             "message": "failed to process comm data. Expecting value: line 1 column 1 (char 0)"
         })
         self.comm.handle_msg(msg_received)
-        self.assertEqual(self.comm.msg_sent, msg_sent)
+        self.assertMsgEqual(self.comm.msg_sent, msg_sent)
     
     def test_can_fail_on_unsupported_command_type(self):
         msg_received = self.create_msg_received("UnsupportedCommand", {"name":"x"});
@@ -94,7 +160,7 @@ class TestCoeCommHandler(unittest.TestCase):
             "message": "command \"UnsupportedCommand\" not supported"
         })
         self.comm.handle_msg(msg_received)
-        self.assertEqual(self.comm.msg_sent, msg_sent)
+        self.assertMsgEqual(self.comm.msg_sent, msg_sent)
     
     def test_can_handle_send_value(self):
         msg_received = self.create_msg_received("SendValue", {
@@ -107,7 +173,7 @@ class TestCoeCommHandler(unittest.TestCase):
         
         msg_sent = self.create_msg_sent("CommandSucceeded")
         self.comm.handle_msg(msg_received)
-        self.assertEqual(self.comm.msg_sent, msg_sent)
+        self.assertMsgEqual(self.comm.msg_sent, msg_sent)
         # below is just a test workaround as tests are not sharing the same 
         # namespace as the handlers. With .net interactive they will be.
         self.assertEqual(coe_comm_handler.x, "test", "variable is not set")
@@ -143,9 +209,80 @@ class TestCoeCommHandler(unittest.TestCase):
         
         msg_sent = self.create_msg_sent("CommandSucceeded")
         self.comm.handle_msg(msg_received)
-        self.assertEqual(self.comm.msg_sent, msg_sent)
+        self.assertMsgEqual(self.comm.msg_sent, msg_sent)
         assert_frame_equal(coe_comm_handler.df_sent, df_expected)
                 
+    def test_can_handle_send_value_with_dataframe_using_schema_types(self):
+        import numpy as np
+        import pandas as pd
+        from pandas.testing import assert_frame_equal
+        data = [
+            {"id": 1, "price": 10.5, "inStock": True, "sold": 3, "updated": "2023-05-17T10:30:00", "size": "S"},
+            {"id": 2, "price": None, "inStock": False, "sold": None, "updated": "2023-05-18T11:00:00", "size": "L"}
+        ]
+        
+        msg_received = self.create_msg_received("SendValue", {
+            "formattedValue":{
+                "mimeType":"application/table-schema+json",
+                "value": json.dumps({
+                    "schema": {
+                        "fields":[
+                            {"name":"id","type":"integer"},
+                            {"name":"price","type":"number"},
+                            {"name":"inStock","type":"boolean"},
+                            {"name":"sold","type":"integer"},
+                            {"name":"updated","type":"datetime"},
+                            {"name":"size","type":"string","constraints":{"enum":["S","M","L"]}}
+                        ],
+                        "primaryKey":[]
+                    },
+                    "data": data
+                })
+            },
+            "name":"df_typed"
+        });
+        
+        self.comm.handle_msg(msg_received)
+        self.assertMsgEqual(self.comm.msg_sent, self.create_msg_sent("CommandSucceeded"))
+        assert_frame_equal(coe_comm_handler.df_typed, pd.DataFrame({
+            "id": np.array([1, 2], dtype=np.int64),
+            "price": np.array([10.5, np.nan]),
+            "inStock": np.array([True, False]),
+            "sold": pd.array([3, None], dtype="Int64"),
+            "updated": pd.to_datetime(["2023-05-17T10:30:00", "2023-05-18T11:00:00"]),
+            "size": pd.Categorical(["S", "L"], categories=["S", "M", "L"])
+        }))
+    
+    def test_can_keep_values_not_matching_schema_types_in_send_value(self):
+        data = [
+            {"id": 1, "price": "10.5", "inStock": "false", "updated": 1684319400, "size": "S"},
+            {"id": 1.7, "price": True, "inStock": True, "updated": "2023-05-18T11:00:00", "size": "XL"}
+        ]
+        
+        msg_received = self.create_msg_received("SendValue", {
+            "formattedValue":{
+                "mimeType":"application/table-schema+json",
+                "value": json.dumps({
+                    "schema": {
+                        "fields":[
+                            {"name":"id","type":"integer"},
+                            {"name":"price","type":"number"},
+                            {"name":"inStock","type":"boolean"},
+                            {"name":"updated","type":"datetime"},
+                            {"name":"size","type":"string","constraints":{"enum":["S","M","L"]}}
+                        ],
+                        "primaryKey":[]
+                    },
+                    "data": data
+                })
+            },
+            "name":"df_mismatched"
+        });
+        
+        self.comm.handle_msg(msg_received)
+        self.assertMsgEqual(self.comm.msg_sent, self.create_msg_sent("CommandSucceeded"))
+        self.assertEqual(coe_comm_handler.df_mismatched.to_dict("records"), data)
+    
     def test_can_handle_unsupported_mimetype_in_send_value(self):
         msg_received = self.create_msg_received("SendValue", {
             "formattedValue":{
@@ -159,7 +296,7 @@ class TestCoeCommHandler(unittest.TestCase):
             "message": "Failed to set value for \"x\". \"application/unsupported\" mimetype not supported."
         })
         self.comm.handle_msg(msg_received)
-        self.assertEqual(self.comm.msg_sent, msg_sent)
+        self.assertMsgEqual(self.comm.msg_sent, msg_sent)
     
     def test_can_handle_invalid_value_for_dataframe_in_send_value(self):
         msg_received = self.create_msg_received("SendValue", {
@@ -174,7 +311,7 @@ class TestCoeCommHandler(unittest.TestCase):
             "message": "Cannot create pandas dataframe for: \"x\". string indices must be integers"
         })
         self.comm.handle_msg(msg_received)
-        self.assertEqual(self.comm.msg_sent, msg_sent)
+        self.assertMsgEqual(self.comm.msg_sent, msg_sent)
     
     def test_can_handle_invalid_identifier_in_send_value(self):
         msg_received = self.create_msg_received("SendValue", {
@@ -189,7 +326,7 @@ class TestCoeCommHandler(unittest.TestCase):
             "message": "Invalid Identifier: \"x.y\""
         })
         self.comm.handle_msg(msg_received)
-        self.assertEqual(self.comm.msg_sent, msg_sent)
+        self.assertMsgEqual(self.comm.msg_sent, msg_sent)
     
     def test_can_handle_request_value_and_get_value(self):
         # below is just a test workaround as tests are not sharing the same 
@@ -205,7 +342,7 @@ class TestCoeCommHandler(unittest.TestCase):
             }
         }, msg_received["content"]["data"]["commandOrEvent"])
         self.comm.handle_msg(msg_received)
-        self.assertEqual(self.comm.msg_sent, msg_sent)
+        self.assertMsgEqual(self.comm.msg_sent, msg_sent)
         
     def test_can_handle_request_dataframe_and_get_value(self):
         data = [
@@ -227,7 +364,765 @@ class TestCoeCommHandler(unittest.TestCase):
             }
         }, msg_received["content"]["data"]["commandOrEvent"])
         self.comm.handle_msg(msg_received)
-        self.assertEqual(self.comm.msg_sent, msg_sent)
+        self.assertMsgEqual(self.comm.msg_sent, msg_sent)
+    
+    def test_can_handle_request_dataframe_with_full_precision_floats(self):
+        import numpy as np
+        import pandas as pd
+        values = [0.12345678901234567, 1234567.123456789, 1e-15, 5e-324, 1.7976931348623157e308, np.nan]
+        coe_comm_handler.df_floats = pd.DataFrame({"x": values, "name": ["a, b", "%s", None, "a, b", "c", "d"], "n": range(6)})
+        coe_comm_handler.series_floats = pd.Series(values)
+        expected = [None if np.isnan(value) else value for value in values]
+        
+        msg_received = self.create_msg_received("RequestValue", {"name": "df_floats", "mimeType": "application/json"});
+        self.comm.handle_msg(msg_received)
+        value = json.loads(self.comm.msg_sent["commandOrEvent"])["event"]["value"]
+        self.assertEqual([row["x"] for row in value], expected)
+        self.assertEqual([row["name"] for row in value], ["a, b", "%s", None, "a, b", "c", "d"])
+        self.assertEqual([row["n"] for row in value], list(range(6)))
+        
+        msg_received = self.create_msg_received("RequestValue", {"name": "series_floats", "mimeType": "application/json"});
+        self.comm.handle_msg(msg_received)
+        self.assertEqual(json.loads(self.comm.msg_sent["commandOrEvent"])["event"]["value"], expected)
+        
+        # floats held in object columns keep their value too, and equal values of other types are not merged
+        objects = ["x", 0.12345678901234567, False, 0, 1.0, 1, None, {"y": 1234567.123456789}]
+        coe_comm_handler.df_objects = pd.DataFrame({"a": objects, "b": range(len(objects))})
+        coe_comm_handler.series_objects = pd.Series(objects)
+        msg_received = self.create_msg_received("RequestValue", {"name": "df_objects", "mimeType": "application/json"});
+        self.comm.handle_msg(msg_received)
+        value = json.loads(self.comm.msg_sent["commandOrEvent"])["event"]["value"]
+        self.assertEqual([repr(row["a"]) for row in value], [repr(item) for item in objects])
+        
+        msg_received = self.create_msg_received("RequestValue", {"name": "series_objects", "mimeType": "application/json"});
+        self.comm.handle_msg(msg_received)
+        value = json.loads(self.comm.msg_sent["commandOrEvent"])["event"]["value"]
+        self.assertEqual([repr(item) for item in value], [repr(item) for item in objects])
+        
+        del coe_comm_handler.df_floats, coe_comm_handler.series_floats, coe_comm_handler.df_objects, coe_comm_handler.series_objects
+    
+    def test_can_handle_request_dataframe_subclass_and_get_value(self):
+        import pandas as pd
+        class OrdersFrame(pd.DataFrame):
+            @property
+            def _constructor(self):
+                return OrdersFrame
+        
+        coe_comm_handler.df_subclass = OrdersFrame({"x": [1, 2]})
+        msg_received = self.create_msg_received("RequestValue", {"name": "df_subclass", "mimeType": "application/json"});
+        msg_sent = self.create_msg_sent("ValueProduced", {
+            "name":"df_subclass",
+            "value":[{"x": 1}, {"x": 2}],
+            "formattedValue":{
+                "mimeType":"application/table-schema+json",
+                "value": coe_comm_handler.df_subclass.to_string(index=False, max_rows=5)
+            }
+        }, msg_received["content"]["data"]["commandOrEvent"])
+        self.comm.handle_msg(msg_received)
+        self.assertMsgEqual(self.comm.msg_sent, msg_sent)
+    
+    def test_can_handle_request_value_with_values_json_can_not_encode(self):
+        import datetime
+        import decimal
+        import numpy as np
+        import pandas as pd
+        coe_comm_handler.x = {
+            "array": np.array([[1.5, np.nan], [np.inf, 2.0]]),
+            "scalar": np.int64(42),
+            "nan": float("nan"),
+            "date": datetime.datetime(2023, 5, 17, 10, 30),
+            "decimal": decimal.Decimal("12.50"),
+            "frame": pd.DataFrame({"a": [1.0, np.nan], "b": ["x", "y"]})
+        }
+        msg_received = self.create_msg_received("RequestValue", {"name": "x", "mimeType": "application/json"});
+        self.comm.handle_msg(msg_received)
+        
+        value = json.loads(self.comm.msg_sent["commandOrEvent"])["event"]["value"]
+        self.assertEqual(value, {
+            "array": [[1.5, None], [None, 2.0]],
+            "scalar": 42,
+            "nan": None,
+            "date": "2023-05-17T10:30:00",
+            "decimal": 12.5,
+            "frame": [{"a": 1.0, "b": "x"}, {"a": None, "b": "y"}]
+        })
+    
+    def test_can_handle_request_value_with_big_integers_and_named_tuples(self):
+        import collections
+        Point = collections.namedtuple("Point", "x y")
+        coe_comm_handler.big_int = 2**70
+        coe_comm_handler.point = Point(1, 2)
+        
+        msg_received = self.create_msg_received("RequestValue", {"name": "big_int", "mimeType": "application/json"});
+        msg_sent = self.create_msg_sent("ValueProduced", {
+            "name":"big_int",
+            "value":2**70,
+            "formattedValue":{
+                "mimeType":"application/json",
+                "value": json.dumps(2**70)
+            }
+        }, msg_received["content"]["data"]["commandOrEvent"])
+        self.comm.handle_msg(msg_received)
+        self.assertMsgEqual(self.comm.msg_sent, msg_sent)
+        
+        msg_received = self.create_msg_received("RequestValue", {"name": "point", "mimeType": "application/json"});
+        msg_sent = self.create_msg_sent("ValueProduced", {
+            "name":"point",
+            "value":[1, 2],
+            "formattedValue":{
+                "mimeType":"application/json",
+                "value": json.dumps([1, 2])
+            }
+        }, msg_received["content"]["data"]["commandOrEvent"])
+        self.comm.handle_msg(msg_received)
+        self.assertMsgEqual(self.comm.msg_sent, msg_sent)
+        
+        del coe_comm_handler.big_int, coe_comm_handler.point
+    
+    def test_can_handle_request_value_if_none_match(self):
+        import pandas as pd
+        coe_comm_handler.df_etag = pd.DataFrame({"x": [1, 2, 3]})
+        msg_received = self.create_msg_received("RequestValue", {"name": "df_etag", "mimeType": "application/json", "ifNoneMatch": None});
+        self.comm.handle_msg(msg_received)
+        event = json.loads(self.comm.msg_sent["commandOrEvent"])
+        self.assertEqual(event["eventType"], "ValueProduced")
+        self.assertEqual(event["event"]["value"], [{"x": 1}, {"x": 2}, {"x": 3}])
+        etag = event["event"]["etag"]
+        
+        msg_received = self.create_msg_received("RequestValue", {"name": "df_etag", "mimeType": "application/json", "ifNoneMatch": etag});
+        msg_sent = self.create_msg_sent("ValueUnchanged", {"name": "df_etag", "etag": etag}, msg_received["content"]["data"]["commandOrEvent"])
+        self.comm.handle_msg(msg_received)
+        self.assertMsgEqual(self.comm.msg_sent, msg_sent)
+        
+        # changing the dataframe in place changes its version
+        coe_comm_handler.df_etag.iloc[0, 0] = 99
+        self.comm.handle_msg(msg_received)
+        event = json.loads(self.comm.msg_sent["commandOrEvent"])
+        self.assertEqual(event["eventType"], "ValueProduced")
+        self.assertEqual(event["event"]["value"], [{"x": 99}, {"x": 2}, {"x": 3}])
+        self.assertNotEqual(event["event"]["etag"], etag)
+        etag = event["event"]["etag"]
+        
+        # reordering the rows in place changes its version too
+        coe_comm_handler.df_etag.sort_values("x", inplace=True)
+        msg_received = self.create_msg_received("RequestValue", {"name": "df_etag", "mimeType": "application/json", "ifNoneMatch": etag});
+        self.comm.handle_msg(msg_received)
+        event = json.loads(self.comm.msg_sent["commandOrEvent"])
+        self.assertEqual(event["eventType"], "ValueProduced")
+        self.assertEqual(event["event"]["value"], [{"x": 2}, {"x": 3}, {"x": 99}])
+        self.assertNotEqual(event["event"]["etag"], etag)
+    
+    def test_can_not_reuse_cached_value_after_send_value(self):
+        coe_comm_handler.text_cached = "before"
+        msg_received = self.create_msg_received("RequestValue", {"name": "text_cached", "mimeType": "application/json"});
+        self.comm.handle_msg(msg_received)
+        self.assertEqual(json.loads(self.comm.msg_sent["commandOrEvent"])["event"]["value"], "before")
+        
+        self.comm.handle_msg(self.create_msg_received("SendValue", {
+            "formattedValue":{
+                "mimeType":"application/json",
+                "value":"\"after\""
+            },
+            "name":"text_cached"
+        }))
+        self.comm.handle_msg(msg_received)
+        event = json.loads(self.comm.msg_sent["commandOrEvent"])
+        self.assertEqual(event["event"]["value"], "after")
+        self.assertNotIn("etag", event["event"])
+    
+    def request_value_delta(self, name, baseVersion = None):
+        msg_received = self.create_msg_received("RequestValue", {"name": name, "mimeType": "application/json", "delta": True, "baseVersion": baseVersion});
+        self.comm.handle_msg(msg_received)
+        event = json.loads(self.comm.msg_sent["commandOrEvent"])
+        self.assertEqual(event["eventType"], "ValueDeltaProduced")
+        return event["event"]
+    
+    def test_can_handle_request_value_delta_for_dataframe(self):
+        import pandas as pd
+        coe_comm_handler.df_delta = pd.DataFrame({"a": [1, 2], "b": ["x", "y"]})
+        delta = self.request_value_delta("df_delta")
+        self.assertEqual((delta["operation"], delta["baseVersion"]), ("replace", None))
+        self.assertEqual(delta["changes"], {"value": [{"a": 1, "b": "x"}, {"a": 2, "b": "y"}]})
+        
+        delta = self.request_value_delta("df_delta", delta["version"])
+        self.assertEqual((delta["operation"], delta["changes"]), ("unchanged", {}))
+        
+        coe_comm_handler.df_delta = pd.concat([coe_comm_handler.df_delta, pd.DataFrame({"a": [3], "b": ["z"]}, index=[2])])
+        base = delta["version"]
+        delta = self.request_value_delta("df_delta", base)
+        self.assertEqual((delta["operation"], delta["baseVersion"]), ("append", base))
+        self.assertEqual(delta["changes"], {"rows": [{"a": 3, "b": "z"}]})
+        
+        coe_comm_handler.df_delta["b"] = ["p", "q", "r"]
+        delta = self.request_value_delta("df_delta", delta["version"])
+        self.assertEqual(delta["operation"], "update")
+        self.assertEqual(delta["changes"], {"columns": {"b": ["p", "q", "r"]}, "removedColumns": [], "columnOrder": ["a", "b"]})
+        
+        # a client that does not hold the last version gets the whole value
+        delta = self.request_value_delta("df_delta", base)
+        self.assertEqual((delta["operation"], delta["baseVersion"]), ("replace", None))
+        self.assertEqual(delta["changes"], {"value": [{"a": 1, "b": "p"}, {"a": 2, "b": "q"}, {"a": 3, "b": "r"}]})
+    
+    def test_can_handle_request_value_delta_for_collections(self):
+        coe_comm_handler.list_delta = [1, "two", {"three": 3}]
+        version = self.request_value_delta("list_delta")["version"]
+        coe_comm_handler.list_delta.append(4)
+        delta = self.request_value_delta("list_delta", version)
+        self.assertEqual((delta["operation"], delta["changes"]), ("append", {"items": [4]}))
+        coe_comm_handler.list_delta[2]["three"] = 33
+        delta = self.request_value_delta("list_delta", delta["version"])
+        self.assertEqual((delta["operation"], delta["changes"]), ("update", {"indices": [2], "items": [{"three": 33}]}))
+        
+        coe_comm_handler.dict_delta = {"a": 1, "b": 2}
+        version = self.request_value_delta("dict_delta")["version"]
+        coe_comm_handler.dict_delta["a"] = 10
+        coe_comm_handler.dict_delta["c"] = 3
+        del coe_comm_handler.dict_delta["b"]
+        delta = self.request_value_delta("dict_delta", version)
+        self.assertEqual((delta["operation"], delta["changes"]), ("update", {"set": {"a": 10, "c": 3}, "removed": ["b"]}))
+        
+        # items are compared by content, -1 and -2 share a hash() and every NaN object hashes differently
+        coe_comm_handler.list_delta = [0, -1, float("nan"), 1]
+        version = self.request_value_delta("list_delta")["version"]
+        coe_comm_handler.list_delta[1] = -2
+        coe_comm_handler.list_delta[2] = float("nan")
+        delta = self.request_value_delta("list_delta", version)
+        self.assertEqual((delta["operation"], delta["changes"]), ("update", {"indices": [1], "items": [-2]}))
+    
+    def test_can_fail_request_value_delta_for_values_json_can_not_encode(self):
+        coe_comm_handler.slice_delta = slice(1, 2)
+        msg_received = self.create_msg_received("RequestValue", {"name": "slice_delta", "mimeType": "application/json", "delta": True});
+        msg_sent = self.create_msg_sent("CommandFailed", {
+            "message": "Cannot compute a delta for \"slice_delta\". Object of type slice is not JSON serializable"
+        }, msg_received["content"]["data"]["commandOrEvent"])
+        self.comm.handle_msg(msg_received)
+        self.assertMsgEqual(self.comm.msg_sent, msg_sent)
+        del coe_comm_handler.slice_delta
+    
+    def test_can_handle_request_value_page_of_dataframe(self):
+        import pandas as pd
+        coe_comm_handler.df_paged = pd.DataFrame({"a": range(100), "b": [f"row {i}" for i in range(100)], "c": 0.5})
+        msg_received = self.create_msg_received("RequestValue", {"name": "df_paged", "mimeType": "application/json", "offset": 10, "limit": 3, "columns": ["b", "a"]});
+        page = coe_comm_handler.df_paged.iloc[10:13][["b", "a"]]
+        msg_sent = self.create_msg_sent("ValuePageProduced", {
+            "name":"df_paged",
+            "value":[{"b": "row 10", "a": 10}, {"b": "row 11", "a": 11}, {"b": "row 12", "a": 12}],
+            "formattedValue":{
+                "mimeType":"application/table-schema+json",
+                "value": page.to_string(index=False, max_rows=5)
+            },
+            "offset": 10,
+            "totalCount": 100
+        }, msg_received["content"]["data"]["commandOrEvent"])
+        self.comm.handle_msg(msg_received)
+        self.assertMsgEqual(self.comm.msg_sent, msg_sent)
+    
+    def test_can_handle_request_value_page_of_sequences(self):
+        coe_comm_handler.list_paged = list(range(50))
+        coe_comm_handler.dict_paged = {f"k{i}": i for i in range(5)}
+        for name, expected, totalCount in [("list_paged", [45, 46, 47, 48, 49], 50), ("dict_paged", {"k1": 1, "k2": 2}, 5)]:
+            msg_received = self.create_msg_received("RequestValue", {"name": name, "mimeType": "application/json", "offset": 45 if name == "list_paged" else 1, "limit": 10 if name == "list_paged" else 2});
+            self.comm.handle_msg(msg_received)
+            event = json.loads(self.comm.msg_sent["commandOrEvent"])
+            self.assertEqual(event["eventType"], "ValuePageProduced")
+            self.assertEqual(event["event"]["value"], expected)
+            self.assertEqual(event["event"]["totalCount"], totalCount)
+    
+    def test_can_handle_request_value_page_of_pyarrow_table_as_arrow_stream(self):
+        import pyarrow as pa
+        coe_comm_handler.table_paged = pa.table({"x": list(range(1000)), "y": [str(i) for i in range(1000)]})
+        msg_received = self.create_msg_received("RequestValue", {"name": "table_paged", "mimeType": "application/vnd.apache.arrow.stream", "offset": 990, "columns": ["x"]});
+        self.comm.handle_msg(msg_received)
+        event = json.loads(self.comm.msg_sent["commandOrEvent"])
+        self.assertEqual(event["eventType"], "ValuePageProduced")
+        self.assertEqual((event["event"]["offset"], event["event"]["totalCount"]), (990, 1000))
+        table_received = pa.ipc.open_stream(self.comm.buffers_sent[0]).read_all()
+        self.assertTrue(table_received.equals(pa.table({"x": list(range(990, 1000))})))
+    
+    def test_can_fail_request_value_page(self):
+        coe_comm_handler.x_paged = 123
+        coe_comm_handler.list_paged = [1, 2, 3]
+        for command, message in [
+            ({"name": "x_paged", "limit": 10}, "Cannot read a page of \"x_paged\". Values of type int can not be paged."),
+            ({"name": "list_paged", "columns": ["a"]}, "Cannot read a page of \"list_paged\". Columns can not be selected from values of type list."),
+            ({"name": "list_paged", "offset": -1}, "Invalid page offset \"-1\" or limit \"1000\" for: \"list_paged\".")]:
+            msg_received = self.create_msg_received("RequestValue", dict(command, mimeType="application/json"));
+            msg_sent = self.create_msg_sent("CommandFailed", {"message": message}, msg_received["content"]["data"]["commandOrEvent"])
+            self.comm.handle_msg(msg_received)
+            self.assertMsgEqual(self.comm.msg_sent, msg_sent)
+    
+    def test_can_handle_request_dataframe_as_arrow_stream(self):
+        data = [
+            {"CategoryName":"Road Frames","ProductName":"HL Road Frame - Black, 58", "Quantity": 2},
+            {"CategoryName":"Helmets","ProductName":"Sport-100 Helmet, Red", "Quantity": 5}
+        ];
+        
+        import pandas as pd
+        import pyarrow as pa
+        from pandas.testing import assert_frame_equal
+        coe_comm_handler.df_arrow = pd.DataFrame(data)
+        msg_received = self.create_msg_received("RequestValue", {"name": "df_arrow", "mimeType": "application/vnd.apache.arrow.stream"});
+        msg_sent = self.create_msg_sent("ValueProduced", {
+            "name":"df_arrow",
+            "value":{ "bufferIndex": 0 },
+            "formattedValue":{
+                "mimeType":"application/vnd.apache.arrow.stream",
+                "value": coe_comm_handler.df_arrow.to_string(index=False, max_rows=5)
+            }
+        }, msg_received["content"]["data"]["commandOrEvent"])
+        self.comm.handle_msg(msg_received)
+        self.assertMsgEqual(self.comm.msg_sent, msg_sent)
+        df_received = pa.ipc.open_stream(self.comm.buffers_sent[0]).read_pandas()
+        assert_frame_equal(df_received, coe_comm_handler.df_arrow)
+    
+    def test_can_fail_request_value_as_arrow_stream_for_non_dataframe(self):
+        coe_comm_handler.x = "test"
+        msg_received = self.create_msg_received("RequestValue", {"name": "x", "mimeType": "application/vnd.apache.arrow.stream"});
+        msg_sent = self.create_msg_sent("CommandFailed", {
+            "message": "Cannot send \"x\" as an arrow stream. Only pandas, polars and pyarrow tables are supported."
+        })
+        self.comm.handle_msg(msg_received)
+        self.assertMsgEqual(self.comm.msg_sent, msg_sent)
+    
+    def test_can_handle_send_value_with_arrow_stream(self):
+        import pandas as pd
+        import pyarrow as pa
+        from pandas.testing import assert_frame_equal
+        df_expected = pd.DataFrame({"x": [1, 2, 3], "y": [0.5, 1.5, 2.5], "z": ["a", "b", "c"]})
+        table = pa.Table.from_pandas(df_expected, preserve_index=False)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        
+        msg_received = self.create_msg_received("SendValue", {
+            "formattedValue":{
+                "mimeType":"application/vnd.apache.arrow.stream",
+                "value": None
+            },
+            "name":"df_arrow_sent"
+        });
+        msg_received["buffers"] = [sink.getvalue().to_pybytes()]
+        
+        msg_sent = self.create_msg_sent("CommandSucceeded")
+        self.comm.handle_msg(msg_received)
+        self.assertMsgEqual(self.comm.msg_sent, msg_sent)
+        assert_frame_equal(coe_comm_handler.df_arrow_sent, df_expected)
+    
+    def test_can_fail_send_value_with_arrow_stream_without_buffers(self):
+        msg_received = self.create_msg_received("SendValue", {
+            "formattedValue":{
+                "mimeType":"application/vnd.apache.arrow.stream",
+                "value": None
+            },
+            "name":"df_arrow_sent"
+        });
+        
+        msg_sent = self.create_msg_sent("CommandFailed", {
+            "message": "Cannot create pandas dataframe for: \"df_arrow_sent\". No arrow stream buffer received."
+        })
+        self.comm.handle_msg(msg_received)
+        self.assertMsgEqual(self.comm.msg_sent, msg_sent)
+    
+    def test_can_handle_request_ndarray_as_shared_memory_and_release_it(self):
+        import numpy as np
+        from multiprocessing import shared_memory
+        coe_comm_handler.arr_shm = np.arange(12, dtype=np.int32).reshape(3, 4)
+        msg_received = self.create_msg_received("RequestValue", {"name": "arr_shm", "mimeType": "application/vnd.dotnet-interactive.shared-memory+json"});
+        self.comm.handle_msg(msg_received)
+        event = json.loads(self.comm.msg_sent["commandOrEvent"])
+        self.assertEqual(event["eventType"], "ValueProduced")
+        descriptor = event["event"]["value"]
+        self.assertEqual(descriptor["kind"], "ndarray")
+        self.assertEqual(json.loads(event["event"]["formattedValue"]["value"]), descriptor)
+        
+        entry = descriptor["arrays"][0]
+        segment = shared_memory.SharedMemory(name=descriptor["segment"])
+        try:
+            arr_received = np.ndarray(tuple(entry["shape"]), dtype=np.dtype(entry["dtype"]), buffer=segment.buf, offset=entry["offset"]).copy()
+        finally:
+            segment.close()
+        np.testing.assert_array_equal(arr_received, coe_comm_handler.arr_shm)
+        
+        msg_received = self.create_msg_received("ReleaseSharedMemory", {"segment": descriptor["segment"]});
+        self.comm.handle_msg(msg_received)
+        self.assertMsgEqual(self.comm.msg_sent, self.create_msg_sent("CommandSucceeded", {}, msg_received["content"]["data"]["commandOrEvent"]))
+        with self.assertRaises(FileNotFoundError):
+            shared_memory.SharedMemory(name=descriptor["segment"])
+        
+        self.comm.handle_msg(msg_received)
+        self.assertMsgEqual(self.comm.msg_sent, self.create_msg_sent("CommandFailed", {
+            "message": f"Shared memory segment \"{descriptor['segment']}\" not found."
+        }, msg_received["content"]["data"]["commandOrEvent"]))
+    
+    def test_can_round_trip_dataframe_through_shared_memory(self):
+        import numpy as np
+        import pandas as pd
+        from pandas.testing import assert_frame_equal
+        coe_comm_handler.df_shm = pd.DataFrame({
+            "x": np.arange(5, dtype=np.int64),
+            "y": np.linspace(0, 1, 5),
+            "flag": [True, False, True, False, True],
+            "at": pd.date_range("2024-01-01", periods=5)
+        })
+        msg_received = self.create_msg_received("RequestValue", {"name": "df_shm", "mimeType": "application/vnd.dotnet-interactive.shared-memory+json"});
+        self.comm.handle_msg(msg_received)
+        descriptor = json.loads(self.comm.msg_sent["commandOrEvent"])["event"]["value"]
+        self.assertEqual(descriptor["kind"], "dataframe")
+        self.assertEqual([entry["name"] for entry in descriptor["arrays"]], ["x", "y", "flag", "at"])
+        self.assertTrue(all(entry["offset"] % 8 == 0 for entry in descriptor["arrays"]))
+        
+        msg_received = self.create_msg_received("SendValue", {
+            "formattedValue":{
+                "mimeType":"application/vnd.dotnet-interactive.shared-memory+json",
+                "value": json.dumps(descriptor)
+            },
+            "name":"df_shm_sent"
+        });
+        self.comm.handle_msg(msg_received)
+        self.assertMsgEqual(self.comm.msg_sent, self.create_msg_sent("CommandSucceeded"))
+        assert_frame_equal(coe_comm_handler.df_shm_sent, coe_comm_handler.df_shm)
+    
+    def test_can_handle_send_value_with_shared_memory(self):
+        import numpy as np
+        from multiprocessing import shared_memory, resource_tracker
+        arr_expected = np.linspace(0, 1, 10)
+        segment = shared_memory.SharedMemory(create=True, size=arr_expected.nbytes)
+        # the sender owns the segment, so it is not tracked by this process
+        resource_tracker.unregister(segment._name, 'shared_memory')
+        try:
+            np.ndarray(arr_expected.shape, dtype=arr_expected.dtype, buffer=segment.buf)[...] = arr_expected
+            msg_received = self.create_msg_received("SendValue", {
+                "formattedValue":{
+                    "mimeType":"application/vnd.dotnet-interactive.shared-memory+json",
+                    "value": json.dumps({
+                        "segment": segment.name,
+                        "size": segment.size,
+                        "kind": "ndarray",
+                        "arrays": [{ "name": None, "dtype": arr_expected.dtype.str, "shape": [10], "offset": 0 }]
+                    })
+                },
+                "name":"arr_shm_sent"
+            });
+            self.comm.handle_msg(msg_received)
+            self.assertMsgEqual(self.comm.msg_sent, self.create_msg_sent("CommandSucceeded"))
+            np.testing.assert_array_equal(coe_comm_handler.arr_shm_sent, arr_expected)
+        finally:
+            segment.close()
+            resource_tracker.register(segment._name, 'shared_memory')
+            segment.unlink()
+    
+    def test_can_fail_request_value_as_shared_memory_for_object_columns(self):
+        import pandas as pd
+        coe_comm_handler.df_shm_objects = pd.DataFrame({"x": [1, 2], "name": ["a", None]}, dtype=object)
+        msg_received = self.create_msg_received("RequestValue", {"name": "df_shm_objects", "mimeType": "application/vnd.dotnet-interactive.shared-memory+json"});
+        msg_sent = self.create_msg_sent("CommandFailed", {
+            "message": "Cannot share \"df_shm_objects\" through shared memory. \"x\" of type object has no fixed size layout."
+        }, msg_received["content"]["data"]["commandOrEvent"])
+        self.comm.handle_msg(msg_received)
+        self.assertMsgEqual(self.comm.msg_sent, msg_sent)
+    
+    def test_can_handle_request_pyarrow_table_as_arrow_stream(self):
+        import pyarrow as pa
+        coe_comm_handler.table_arrow = pa.table({"x": [1, 2, 3], "y": ["a", "b", "c"]})
+        msg_received = self.create_msg_received("RequestValue", {"name": "table_arrow", "mimeType": "application/vnd.apache.arrow.stream"});
+        self.comm.handle_msg(msg_received)
+        event = json.loads(self.comm.msg_sent["commandOrEvent"])
+        self.assertEqual(event["eventType"], "ValueProduced")
+        self.assertEqual(event["event"]["value"], {"bufferIndex": 0})
+        table_received = pa.ipc.open_stream(self.comm.buffers_sent[0]).read_all()
+        self.assertTrue(table_received.equals(coe_comm_handler.table_arrow))
+    
+    def test_can_handle_request_pyarrow_table_as_json(self):
+        import pyarrow as pa
+        coe_comm_handler.table_json = pa.table({"x": [1, 2], "y": ["a", None]})
+        msg_received = self.create_msg_received("RequestValue", {"name": "table_json", "mimeType": "application/json"});
+        self.comm.handle_msg(msg_received)
+        event = json.loads(self.comm.msg_sent["commandOrEvent"])
+        self.assertEqual(event["event"]["value"], [{"x": 1, "y": "a"}, {"x": 2, "y": None}])
+    
+    def test_can_handle_request_ndarray_as_typed_buffers(self):
+        import numpy as np
+        coe_comm_handler.arr_typed = np.arange(6, dtype=np.float32).reshape(2, 3)
+        msg_received = self.create_msg_received("RequestValue", {"name": "arr_typed", "mimeType": "application/vnd.dotnet-interactive.typed-buffers+json"});
+        self.comm.handle_msg(msg_received)
+        event = json.loads(self.comm.msg_sent["commandOrEvent"])
+        self.assertEqual(event["eventType"], "ValueProduced")
+        self.assertEqual(event["event"]["value"], {
+            "kind": "ndarray",
+            "arrays": [{"name": None, "dtype": "<f4", "shape": [2, 3], "bufferIndex": 0}]
+        })
+        self.assertEqual(json.loads(event["event"]["formattedValue"]["value"]), event["event"]["value"])
+        arr_received = np.frombuffer(self.comm.buffers_sent[0], dtype="<f4").reshape(2, 3)
+        np.testing.assert_array_equal(arr_received, coe_comm_handler.arr_typed)
+    
+    def test_can_handle_request_tables_as_typed_buffers(self):
+        import numpy as np
+        import pandas as pd
+        import pyarrow as pa
+        coe_comm_handler.df_typed = pd.DataFrame({"x": np.arange(3), "at": pd.date_range("2024-01-01", periods=3)})
+        coe_comm_handler.table_typed = pa.table({"x": [1, 2, 3], "y": [0.5, 1.5, 2.5]})
+        for name, expected in [("df_typed", {"x": coe_comm_handler.df_typed["x"].to_numpy(), "at": coe_comm_handler.df_typed["at"].to_numpy()}),
+                               ("table_typed", {"x": np.array([1, 2, 3]), "y": np.array([0.5, 1.5, 2.5])})]:
+            msg_received = self.create_msg_received("RequestValue", {"name": name, "mimeType": "application/vnd.dotnet-interactive.typed-buffers+json"});
+            self.comm.handle_msg(msg_received)
+            descriptor = json.loads(self.comm.msg_sent["commandOrEvent"])["event"]["value"]
+            self.assertEqual(descriptor["kind"], "dataframe")
+            self.assertEqual([entry["name"] for entry in descriptor["arrays"]], list(expected))
+            for entry in descriptor["arrays"]:
+                column = np.frombuffer(self.comm.buffers_sent[entry["bufferIndex"]], dtype=np.dtype(entry["dtype"]))
+                np.testing.assert_array_equal(column, expected[entry["name"]])
+    
+    def test_can_fail_request_value_as_typed_buffers_for_object_columns(self):
+        import pandas as pd
+        coe_comm_handler.df_typed_objects = pd.DataFrame({"name": ["a", "b"]}, dtype=object)
+        msg_received = self.create_msg_received("RequestValue", {"name": "df_typed_objects", "mimeType": "application/vnd.dotnet-interactive.typed-buffers+json"});
+        msg_sent = self.create_msg_sent("CommandFailed", {
+            "message": "Cannot send \"df_typed_objects\" as typed buffers. \"name\" of type object has no fixed size layout."
+        }, msg_received["content"]["data"]["commandOrEvent"])
+        self.comm.handle_msg(msg_received)
+        self.assertMsgEqual(self.comm.msg_sent, msg_sent)
+    
+    def test_can_handle_send_value_with_typed_buffers(self):
+        import numpy as np
+        import pyarrow as pa
+        arr_expected = np.arange(12, dtype=np.int16).reshape(3, 4)
+        msg_received = self.create_msg_received("SendValue", {
+            "formattedValue":{
+                "mimeType":"application/vnd.dotnet-interactive.typed-buffers+json",
+                "value": json.dumps({"kind": "ndarray", "arrays": [{"name": None, "dtype": "<i2", "shape": [3, 4], "bufferIndex": 0}]})
+            },
+            "name":"arr_typed_sent"
+        });
+        msg_received["buffers"] = [arr_expected.tobytes()]
+        self.comm.handle_msg(msg_received)
+        self.assertMsgEqual(self.comm.msg_sent, self.create_msg_sent("CommandSucceeded"))
+        np.testing.assert_array_equal(coe_comm_handler.arr_typed_sent, arr_expected)
+        self.assertTrue(coe_comm_handler.arr_typed_sent.flags.writeable)
+        
+        msg_received = self.create_msg_received("SendValue", {
+            "formattedValue":{
+                "mimeType":"application/vnd.dotnet-interactive.typed-buffers+json",
+                "value": json.dumps({"kind": "dataframe", "arrays": [
+                    {"name": "x", "dtype": "<i8", "shape": [2], "bufferIndex": 1},
+                    {"name": "y", "dtype": "<f8", "shape": [2], "bufferIndex": 0}
+                ]})
+            },
+            "name":"table_typed_sent",
+            "targetType":"pyarrow"
+        });
+        msg_received["buffers"] = [np.array([0.5, 1.5]).tobytes(), np.array([1, 2], dtype=np.int64).tobytes()]
+        self.comm.handle_msg(msg_received)
+        self.assertMsgEqual(self.comm.msg_sent, self.create_msg_sent("CommandSucceeded"))
+        self.assertTrue(coe_comm_handler.table_typed_sent.equals(pa.table({"x": [1, 2], "y": [0.5, 1.5]})))
+    
+    def test_can_handle_send_value_with_arrow_stream_as_pyarrow_table(self):
+        import pyarrow as pa
+        table_expected = pa.table({"x": [1, 2, 3], "z": ["a", "b", "c"]})
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table_expected.schema) as writer:
+            writer.write_table(table_expected)
+        
+        msg_received = self.create_msg_received("SendValue", {
+            "formattedValue":{
+                "mimeType":"application/vnd.apache.arrow.stream",
+                "value": None
+            },
+            "name":"table_arrow_sent",
+            "targetType":"pyarrow"
+        });
+        msg_received["buffers"] = [sink.getvalue().to_pybytes()]
+        self.comm.handle_msg(msg_received)
+        self.assertMsgEqual(self.comm.msg_sent, self.create_msg_sent("CommandSucceeded"))
+        self.assertTrue(coe_comm_handler.table_arrow_sent.equals(table_expected))
+    
+    def test_can_stream_request_value_as_chunks_with_acknowledgements(self):
+        import pandas as pd
+        coe_comm_handler.df_streamed = pd.DataFrame({"x": range(2500), "y": [str(i) for i in range(2500)]})
+        msg_received = self.create_msg_received("RequestValue", {"name": "df_streamed", "mimeType": "application/json", "chunkSize": 10000, "window": 2});
+        self.comm.handle_msg(msg_received)
+        
+        events = [json.loads(msg["commandOrEvent"]) for msg in self.comm.msgs_sent[1:]]
+        self.assertEqual([e["eventType"] for e in events], ["ValueChunkProduced", "ValueChunkProduced"])
+        self.assertEqual([e["event"]["sequence"] for e in events], [0, 1])
+        
+        while events[-1]["eventType"] != "ValueStreamCompleted":
+            self.comm.handle_msg(self.create_msg_received("AcknowledgeValueChunk", {"streamToken": "19", "sequence": events[-1]["event"]["sequence"]}))
+            events = [json.loads(msg["commandOrEvent"]) for msg in self.comm.msgs_sent[1:]]
+        
+        chunks = [e["event"]["chunk"] for e in events[:-1]]
+        self.assertTrue(all(len(chunk) <= 10000 for chunk in chunks))
+        self.assertEqual(json.loads("".join(chunks)), coe_comm_handler.df_streamed.to_dict('records'))
+        self.assertEqual(events[-1]["event"], {
+            "name": "df_streamed",
+            "chunkCount": len(chunks),
+            "formattedValue": {
+                "mimeType": "application/table-schema+json",
+                "value": coe_comm_handler.df_streamed.to_string(index=False, max_rows=5)
+            }
+        })
+    
+    def test_can_stream_request_value_as_chunks(self):
+        coe_comm_handler.x = {"values": list(range(100)), "name": "test"}
+        msg_received = self.create_msg_received("RequestValue", {"name": "x", "mimeType": "application/json", "chunkSize": 16, "window": 100});
+        self.comm.handle_msg(msg_received)
+        
+        events = [json.loads(msg["commandOrEvent"]) for msg in self.comm.msgs_sent[1:]]
+        self.assertEqual(events[-1]["eventType"], "ValueStreamCompleted")
+        self.assertEqual("".join(e["event"]["chunk"] for e in events[:-1]), json.dumps(coe_comm_handler.x))
+    
+    def test_can_stream_request_value_with_non_finite_floats_and_converted_values(self):
+        import numpy as np
+        import pandas as pd
+        coe_comm_handler.x = {"floats": [1.5, float("nan"), float("inf"), -float("inf")], "series": pd.Series([1, 2]), "array": np.arange(3)}
+        coe_comm_handler.y = np.arange(2500, dtype=np.float64)
+        coe_comm_handler.y[3] = np.nan
+        for name, expected in [("x", {"floats": [1.5, None, None, None], "series": [1, 2], "array": [0, 1, 2]}), ("y", [None if i == 3 else float(i) for i in range(2500)])]:
+            self.comm.msgs_sent.clear()
+            self.comm.handle_msg(self.create_msg_received("RequestValue", {"name": name, "mimeType": "application/json", "chunkSize": 64, "window": 100000}))
+            events = [json.loads(msg["commandOrEvent"]) for msg in self.comm.msgs_sent]
+            self.assertEqual(events[-1]["eventType"], "ValueStreamCompleted")
+            self.assertEqual(json.loads("".join(e["event"]["chunk"] for e in events[:-1])), expected)
+    
+    def test_can_stream_request_value_without_copying_the_value(self):
+        import tracemalloc
+        coe_comm_handler.x = [{"id": i, "value": i * 0.5} for i in range(200000)]
+        tracemalloc.start()
+        try:
+            self.comm.handle_msg(self.create_msg_received("RequestValue", {"name": "x", "mimeType": "application/json", "chunkSize": 1000, "window": 2}))
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(json.loads(self.comm.msg_sent["commandOrEvent"])["eventType"], "ValueChunkProduced")
+        self.assertLess(peak, 2**20)
+        del coe_comm_handler.x
+    
+    def test_can_cancel_value_stream(self):
+        coe_comm_handler.x = list(range(1000))
+        self.comm.handle_msg(self.create_msg_received("RequestValue", {"name": "x", "mimeType": "application/json", "chunkSize": 16, "window": 1}))
+        msg_received = self.create_msg_received("CancelValueStream", {"streamToken": "19"})
+        self.comm.handle_msg(msg_received)
+        self.assertMsgEqual(self.comm.msg_sent, self.create_msg_sent("CommandSucceeded", {}, msg_received["content"]["data"]["commandOrEvent"]))
+        
+        msg_received = self.create_msg_received("AcknowledgeValueChunk", {"streamToken": "19", "sequence": 0})
+        self.comm.handle_msg(msg_received)
+        self.assertMsgEqual(self.comm.msg_sent, self.create_msg_sent("CommandFailed", {
+            "message": "Value stream \"19\" not found."
+        }, msg_received["content"]["data"]["commandOrEvent"]))
+    
+    def test_can_handle_request_value_asynchronously(self):
+        comm = testComm()
+        handler = get_dotnet_coe_comm_handler()
+        handler.handle_control_comm_opened(comm, {"content": {"data": {"executionMode": "async", "maxConcurrency": 2}}})
+        
+        coe_comm_handler.x = "test"
+        msg_received = self.create_msg_received("RequestValue", {"name": "x", "mimeType": "application/json"});
+        comm.handle_msg(msg_received)
+        msg_received_unknown = self.create_msg_received("RequestValue", {"name": "unknown_var", "mimeType": "application/json"});
+        comm.handle_msg(msg_received_unknown)
+        
+        # ready event plus one reply per command
+        deadline = time.time() + 10
+        while len(comm.msgs_sent) < 3 and time.time() < deadline:
+            time.sleep(0.01)
+        comm.close()
+        
+        self.assertEqual(len(comm.msgs_sent), 3)
+        self.assertMsgIn(self.create_msg_sent("ValueProduced", {
+            "name":"x",
+            "value":"test",
+            "formattedValue":{
+                "mimeType":"application/json",
+                "value": json.dumps("test")
+            }
+        }, msg_received["content"]["data"]["commandOrEvent"]), comm.msgs_sent)
+        # failures are correlated with the command that caused them
+        self.assertMsgIn(self.create_msg_sent("CommandFailed", {
+            "message": "Variable \"unknown_var\" not found."
+        }, msg_received_unknown["content"]["data"]["commandOrEvent"]), comm.msgs_sent)
+    
+    def test_can_handle_request_values_in_one_batch(self):
+        import pandas as pd
+        import pyarrow as pa
+        from pandas.testing import assert_frame_equal
+        coe_comm_handler.x_batch = [1, 2, 3]
+        coe_comm_handler.df_batch_1 = pd.DataFrame({"x": [1, 2]})
+        coe_comm_handler.df_batch_2 = pd.DataFrame({"y": ["a", "b", "c"]})
+        msg_received = self.create_msg_received("RequestValues", {"requests": [
+            {"name": "df_batch_1", "mimeType": "application/vnd.apache.arrow.stream"},
+            {"name": "x_batch", "mimeType": "application/json"},
+            {"name": "unknown_batch_var", "mimeType": "application/json"},
+            {"name": "df_batch_2", "mimeType": "application/vnd.apache.arrow.stream"}
+        ]});
+        self.comm.msgs_sent.clear()
+        self.comm.handle_msg(msg_received)
+        self.assertEqual(len(self.comm.msgs_sent), 1)
+        event = json.loads(self.comm.msg_sent["commandOrEvent"])
+        self.assertEqual(event["eventType"], "ValuesProduced")
+        self.assertEqual(event["command"], json.loads(msg_received["content"]["data"]["commandOrEvent"]))
+        values = event["event"]["values"]
+        self.assertEqual([value["eventType"] for value in values], ["ValueProduced", "ValueProduced", "CommandFailed", "ValueProduced"])
+        self.assertEqual(values[1]["event"]["name"], "x_batch")
+        self.assertEqual(values[1]["event"]["value"], [1, 2, 3])
+        self.assertEqual(json.loads(values[1]["event"]["formattedValue"]["value"]), [1, 2, 3])
+        self.assertEqual(values[2]["event"], {"message": "Variable \"unknown_batch_var\" not found."})
+        
+        self.assertEqual(len(self.comm.buffers_sent), 2)
+        for value, df_expected in [(values[0], coe_comm_handler.df_batch_1), (values[3], coe_comm_handler.df_batch_2)]:
+            buffer = self.comm.buffers_sent[value["event"]["value"]["bufferIndex"]]
+            assert_frame_equal(pa.ipc.open_stream(buffer).read_pandas(), df_expected)
+    
+    def test_can_handle_request_values_with_values_json_can_not_encode(self):
+        coe_comm_handler.x_batch = [1, 2, 3]
+        coe_comm_handler.slice_batch = slice(1, 2)
+        msg_received = self.create_msg_received("RequestValues", {"requests": [
+            {"name": "slice_batch", "mimeType": "application/json"},
+            {"name": "x_batch", "mimeType": "application/json"}
+        ]});
+        self.comm.handle_msg(msg_received)
+        event = json.loads(self.comm.msg_sent["commandOrEvent"])
+        self.assertEqual(event["eventType"], "ValuesProduced")
+        self.assertEqual(event["command"], json.loads(msg_received["content"]["data"]["commandOrEvent"]))
+        values = event["event"]["values"]
+        self.assertEqual([value["eventType"] for value in values], ["CommandFailed", "ValueProduced"])
+        self.assertEqual(values[0]["event"], {"message": "Failed to produce value for \"slice_batch\". Object of type slice is not JSON serializable"})
+        self.assertEqual(values[1]["event"]["value"], [1, 2, 3])
+        del coe_comm_handler.slice_batch
+    
+    def test_can_handle_request_values_with_typed_buffers_in_one_batch(self):
+        import numpy as np
+        coe_comm_handler.arr_batch_1 = np.arange(3)
+        coe_comm_handler.arr_batch_2 = np.arange(4, dtype=np.float64)
+        msg_received = self.create_msg_received("RequestValues", {"requests": [
+            {"name": "arr_batch_1", "mimeType": "application/vnd.dotnet-interactive.typed-buffers+json"},
+            {"name": "arr_batch_2", "mimeType": "application/vnd.dotnet-interactive.typed-buffers+json"}
+        ]});
+        self.comm.handle_msg(msg_received)
+        values = json.loads(self.comm.msg_sent["commandOrEvent"])["event"]["values"]
+        self.assertEqual(len(self.comm.buffers_sent), 2)
+        for value, expected in zip(values, [coe_comm_handler.arr_batch_1, coe_comm_handler.arr_batch_2]):
+            entry = value["event"]["value"]["arrays"][0]
+            self.assertEqual(json.loads(value["event"]["formattedValue"]["value"]), value["event"]["value"])
+            np.testing.assert_array_equal(np.frombuffer(self.comm.buffers_sent[entry["bufferIndex"]], dtype=np.dtype(entry["dtype"])), expected)
+    
+    def test_can_handle_request_values_as_a_stream(self):
+        coe_comm_handler.x_batch = [1, 2, 3]
+        coe_comm_handler.y_batch = "test"
+        msg_received = self.create_msg_received("RequestValues", {"mode": "stream", "requests": [
+            {"name": "x_batch", "mimeType": "application/json"},
+            {"name": "y_batch", "mimeType": "application/json", "chunkSize": 10}
+        ]});
+        self.comm.msgs_sent.clear()
+        self.comm.handle_msg(msg_received)
+        command = msg_received["content"]["data"]["commandOrEvent"]
+        self.assertEqual(len(self.comm.msgs_sent), 3)
+        value = json.loads(self.comm.msgs_sent[0]["commandOrEvent"])["event"]["values"][0]
+        self.assertEqual(value["eventType"], "ValueProduced")
+        self.assertEqual(value["event"]["value"], [1, 2, 3])
+        self.assertMsgEqual(self.comm.msgs_sent[1], self.create_msg_sent("ValuesProduced", {"values": [{
+            "eventType": "CommandFailed",
+            "event": {"message": "Cannot stream \"y_batch\" as chunks in a batch."}
+        }]}, command))
+        self.assertMsgEqual(self.comm.msgs_sent[2], self.create_msg_sent("CommandSucceeded", {}, command))
     
     def test_can_handle_unknown_variable_request_value(self):
         msg_received = self.create_msg_received("RequestValue", {"name": "unknown_var", "mimeType": "application/json"});
@@ -235,8 +1130,43 @@ class TestCoeCommHandler(unittest.TestCase):
             "message": "Variable \"unknown_var\" not found."
         })
         self.comm.handle_msg(msg_received)
-        self.assertEqual(self.comm.msg_sent, msg_sent)
+        self.assertMsgEqual(self.comm.msg_sent, msg_sent)
+        
+    def test_can_handle_request_diagnostics(self):
+        coe_comm_handler.x_diagnostics = [1, 2, 3]
+        self.comm.handle_msg(self.create_msg_received("RequestValue", {"name": "x_diagnostics", "mimeType": "application/json"}))
+        self.comm.handle_msg(self.create_msg_received("RequestValue", {"name": "unknown_var", "mimeType": "application/json"}))
+        self.comm.handle_msg(self.create_msg_received("SendValue", {
+            "formattedValue":{
+                "mimeType":"application/table-schema+json",
+                "value":"[1, 2]"
+            },
+            "name":"df_diagnostics"
+        }))
+        
+        msg_received = self.create_msg_received("RequestDiagnostics", {"reset": True});
+        self.comm.handle_msg(msg_received)
+        event = json.loads(self.comm.msg_sent["commandOrEvent"])
+        self.assertEqual(event["eventType"], "DiagnosticsProduced")
+        commands = event["event"]["commands"]
+        self.assertEqual(commands["RequestValue"]["count"], 2)
+        self.assertEqual(commands["RequestValue"]["errors"], 1)
+        self.assertEqual(set(commands["RequestValue"]["phases"]), {"parse", "lookup", "serialize", "encode", "send"})
+        self.assertEqual(commands["RequestValue"]["phases"]["parse"]["count"], 2)
+        self.assertEqual(commands["RequestValue"]["phases"]["serialize"]["count"], 1)
+        self.assertEqual(commands["RequestValue"]["phases"]["encode"]["count"], 2)
+        self.assertEqual(commands["RequestValue"]["payloadBytes"]["count"], 2)
+        self.assertEqual(commands["SendValue"]["errors"], 1)
+        self.assertEqual(event["event"]["valueTypes"]["builtins.list"]["count"], 1)
+        self.assertEqual([entry["source"] for entry in event["event"]["log"]], ["__handle_send_value.dataframe.error"])
+        self.assertEqual(event["event"]["log"][0]["commandType"], "SendValue")
+        self.assertFalse([key for key in vars(coe_comm_handler) if key.startswith("__log__coe_handler")])
         
+        self.comm.handle_msg(msg_received)
+        event = json.loads(self.comm.msg_sent["commandOrEvent"])
+        self.assertEqual(list(event["event"]["commands"]), ["RequestDiagnostics"])
+        self.assertEqual(event["event"]["log"], [])
+    
     def test_can_handle_request_value_infos_and_get_values(self):
         # below is just a test workaround as tests are not sharing the same 
         # namespace as the handlers, so for now we inject the same variable in both.
@@ -256,21 +1186,219 @@ class TestCoeCommHandler(unittest.TestCase):
                 {
                     "name": "df", 
                     "formattedValue": {
-                        "mimeType":"application/table-schema+json",
-                        "value": df.to_string(index=False, max_rows=5)
+                        "mimeType":"text/plain+summary",
+                        "value": df.to_string(max_rows=10, max_cols=10, show_dimensions='truncate')
                     }, 
-                    "typeName": "<class \'pandas.core.frame.DataFrame\'>"
+                    "typeName": str(type(df))
                 },
                 {
                     "name": "x", 
                     "formattedValue": {
-                        "mimeType":"application/json",
+                        "mimeType":"text/plain+summary",
                         "value": "456"
                     }, 
                     "typeName": "<class \'int\'>"
                 }]
         }, msg_received["content"]["data"]["commandOrEvent"])
         self.comm.handle_msg(msg_received)
-        self.assertEqual(self.comm.msg_sent, msg_sent)
+        self.assertMsgEqual(self.comm.msg_sent, msg_sent)
+    
+    def test_can_handle_request_value_infos_with_bounded_summaries(self):
+        import numpy as np
+        global big_list, big_string, big_array
+        big_list = list(range(1000000))
+        big_string = "x" * 1000000
+        big_array = np.arange(1000000)
+        coe_comm_handler.big_list = big_list
+        coe_comm_handler.big_string = big_string
+        coe_comm_handler.big_array = big_array
+        
+        self.comm.handle_msg(self.create_msg_received("RequestValueInfos"))
+        summaries = { info["name"]: info["formattedValue"]["value"] for info in json.loads(self.comm.msg_sent["commandOrEvent"])["event"]["valueInfos"] }
+        
+        self.assertEqual(summaries["big_list"], "[0, 1, 2, 3, 4, 5, 6, 7, 8, 9, ...] (1000000 items)")
+        self.assertEqual(summaries["big_string"], "x" * 500 + "...")
+        self.assertEqual(summaries["big_array"], "[     0      1      2 ... 999997 999998 999999] shape=(1000000,) dtype=int64")
+        
+        del coe_comm_handler.big_list, coe_comm_handler.big_string, coe_comm_handler.big_array
+    
+    def test_can_handle_request_value_infos_with_bounded_summaries_of_collection_subclasses(self):
+        import collections
+        global big_counter, big_ordered
+        big_counter = collections.Counter(range(1000000))
+        big_ordered = collections.OrderedDict.fromkeys(range(1000000))
+        coe_comm_handler.big_counter = big_counter
+        coe_comm_handler.big_ordered = big_ordered
+        
+        self.comm.handle_msg(self.create_msg_received("RequestValueInfos", {"namePrefix": "big_"}))
+        summaries = { info["name"]: info["formattedValue"]["value"] for info in json.loads(self.comm.msg_sent["commandOrEvent"])["event"]["valueInfos"] }
+        
+        self.assertEqual(summaries["big_counter"], "Counter({0: 1, 1: 1, 2: 1, 3: 1, 4: 1, 5: 1, 6: 1, 7: 1, 8: 1, 9: 1, ...}) (1000000 items)")
+        self.assertEqual(summaries["big_ordered"], "OrderedDict({0: None, 1: None, 2: None, 3: None, 4: None, 5: None, 6: None, 7: None, 8: None, 9: None, ...}) (1000000 items)")
+        
+        del coe_comm_handler.big_counter, coe_comm_handler.big_ordered
+    
+    def test_can_handle_request_value_infos_with_summaries_of_other_types(self):
+        import collections
+        import datetime
+        import numpy as np
+        global big_deque, date_value, half_value
+        big_deque = collections.deque(range(3000000))
+        date_value = datetime.datetime(2023, 1, 1)
+        half_value = np.float16(1.5)
+        coe_comm_handler.big_deque = big_deque
+        coe_comm_handler.date_value = date_value
+        coe_comm_handler.half_value = half_value
+        
+        self.comm.handle_msg(self.create_msg_received("RequestValueInfos", {"types": ["collections.deque", "datetime.datetime", "numpy.float16"]}))
+        summaries = { info["name"]: info["formattedValue"]["value"] for info in json.loads(self.comm.msg_sent["commandOrEvent"])["event"]["valueInfos"] }
+        
+        self.assertEqual(summaries["big_deque"], "deque([0, 1, 2, 3, 4, 5, 6, 7, 8, 9, ...])")
+        self.assertEqual(summaries["date_value"], "2023-01-01 00:00:00")
+        self.assertEqual(summaries["half_value"], "1.5")
+        
+        del coe_comm_handler.big_deque, coe_comm_handler.date_value, coe_comm_handler.half_value
+    
+    def test_can_handle_request_value_infos_since_generation(self):
+        # below is just a test workaround as tests are not sharing the same 
+        # namespace as the handlers, so for now we inject the same variable in both.
+        # With .net interactive they will be.
+        global x 
+        x = 456
+        coe_comm_handler.x = x
+        
+        import pandas as pd
+        global df
+        df = pd.DataFrame([{"x": 123}, {"x": 456}])
+        coe_comm_handler.df = df
+        
+        def request_value_infos(sinceGeneration):
+            self.comm.handle_msg(self.create_msg_received("RequestValueInfos", {"sinceGeneration": sinceGeneration}))
+            return json.loads(self.comm.msg_sent["commandOrEvent"])["event"]
+        
+        event = request_value_infos(0)
+        self.assertEqual([info["name"] for info in event["valueInfos"]], ["df", "x"])
+        self.assertEqual(event["removedNames"], [])
+        generation = event["generation"]
+        
+        event = request_value_infos(generation)
+        self.assertEqual(event, {"valueInfos": [], "generation": generation, "removedNames": []})
+        
+        x = 789
+        coe_comm_handler.x = x
+        event = request_value_infos(generation)
+        self.assertEqual([(info["name"], info["formattedValue"]["value"]) for info in event["valueInfos"]], [("x", "789")])
+        generation = event["generation"]
+        
+        del coe_comm_handler.df
+        event = request_value_infos(generation)
+        self.assertEqual(event["valueInfos"], [])
+        self.assertEqual(event["removedNames"], ["df"])
+        
+    def test_can_handle_request_value_infos_after_values_changed_in_place(self):
+        import gc
+        import weakref
+        import pandas as pd
+        global changed_dict, changed_df
+        changed_dict = {"a": 1}
+        changed_df = pd.DataFrame({"x": list(range(100))})
+        coe_comm_handler.changed_dict = changed_dict
+        coe_comm_handler.changed_df = changed_df
+        
+        def request_value_infos(sinceGeneration):
+            self.comm.handle_msg(self.create_msg_received("RequestValueInfos", {"sinceGeneration": sinceGeneration, "namePrefix": "changed_"}))
+            return json.loads(self.comm.msg_sent["commandOrEvent"])["event"]
+        
+        generation = request_value_infos(0)["generation"]
+        changed_dict["a"] = 2
+        changed_df.iloc[0, 0] = 99
+        event = request_value_infos(generation)
+        summaries = { info["name"]: info["formattedValue"]["value"] for info in event["valueInfos"] }
+        self.assertEqual(summaries["changed_dict"], "{'a': 2}")
+        self.assertEqual(summaries["changed_df"], changed_df.to_string(max_rows=10, max_cols=10, show_dimensions='truncate'))
+        self.assertEqual(request_value_infos(event["generation"])["valueInfos"], [])
+        
+        # the cache does not keep a deleted value alive
+        ref = weakref.ref(changed_df)
+        del coe_comm_handler.changed_df, changed_df
+        gc.collect()
+        self.assertIsNone(ref())
+        del coe_comm_handler.changed_dict
+        
+    def test_can_handle_request_value_infos_with_name_prefix_and_types(self):
+        # below is just a test workaround as tests are not sharing the same 
+        # namespace as the handlers, so for now we inject the same variable in both.
+        # With .net interactive they will be.
+        import pandas as pd
+        global filter_count, filter_name, filter_df, _filter_hidden
+        filter_count = 1
+        filter_name = "name"
+        filter_df = pd.DataFrame([{"x": 123}])
+        _filter_hidden = 2
+        for name in ["filter_count", "filter_name", "filter_df", "_filter_hidden"]:
+            setattr(coe_comm_handler, name, globals()[name])
+        
+        def request_value_infos(command):
+            self.comm.handle_msg(self.create_msg_received("RequestValueInfos", command))
+            return json.loads(self.comm.msg_sent["commandOrEvent"])["event"]
+        
+        event = request_value_infos({"namePrefix": "filter_"})
+        self.assertEqual([info["name"] for info in event["valueInfos"]], ["filter_count", "filter_df", "filter_name"])
+        
+        event = request_value_infos({"namePrefix": "filter_", "types": ["dataframe", "builtins.str"]})
+        self.assertEqual([info["name"] for info in event["valueInfos"]], ["filter_df", "filter_name"])
+        
+        event = request_value_infos({"sinceGeneration": 0, "namePrefix": "filter_", "types": ["scalar"]})
+        self.assertEqual([info["name"] for info in event["valueInfos"]], ["filter_count"])
+        self.assertEqual(event["removedNames"], [])
+        
+        for name in ["filter_count", "filter_name", "filter_df", "_filter_hidden"]:
+            delattr(coe_comm_handler, name)
+        
+    def test_can_push_value_infos_changed_after_cells_run(self):
+        # below is just a test workaround as tests are not sharing the same 
+        # namespace as the handlers, so for now we inject the same variable in both.
+        # With .net interactive they will be.
+        global pushed_x, pushed_y
+        pushed_x = 1
+        coe_comm_handler.pushed_x = pushed_x
+        
+        def run_cell():
+            self.comm.msgs_sent.clear()
+            get_ipython().events.trigger('post_run_cell', None)
+            return [json.loads(msg["commandOrEvent"]) for msg in self.comm.msgs_sent]
+        
+        self.comm.handle_msg(self.create_msg_received("SubscribeValueInfos", {"namePrefix": "pushed_"}))
+        event = json.loads(self.comm.msg_sent["commandOrEvent"])
+        self.assertEqual(event["eventType"], "ValueInfosProduced")
+        self.assertEqual([info["name"] for info in event["event"]["valueInfos"]], ["pushed_x"])
+        
+        self.assertEqual(run_cell(), [])
+        
+        pushed_x = 2
+        pushed_y = "y"
+        coe_comm_handler.pushed_x = pushed_x
+        coe_comm_handler.pushed_y = pushed_y
+        events = run_cell()
+        self.assertEqual([e["eventType"] for e in events], ["ValueInfosChanged"])
+        self.assertEqual([(info["name"], info["formattedValue"]["value"]) for info in events[0]["event"]["valueInfos"]], [("pushed_x", "2"), ("pushed_y", "y")])
+        self.assertEqual(events[0]["event"]["removedNames"], [])
+        
+        del coe_comm_handler.pushed_y
+        events = run_cell()
+        self.assertEqual(events[0]["event"]["valueInfos"], [])
+        self.assertEqual(events[0]["event"]["removedNames"], ["pushed_y"])
+        
+        self.comm.handle_msg(self.create_msg_received("UnsubscribeValueInfos"))
+        self.assertEqual(json.loads(self.comm.msg_sent["commandOrEvent"])["eventType"], "CommandSucceeded")
+        coe_comm_handler.pushed_x = 3
+        self.assertEqual(run_cell(), [])
+        
+        self.comm.handle_msg(self.create_msg_received("SubscribeValueInfos", {"namePrefix": "pushed_"}))
+        self.comm.close()
+        coe_comm_handler.pushed_x = 4
+        self.assertEqual(run_cell(), [])
+        
+        del coe_comm_handler.pushed_x
         
 unittest.main(argv=[''], verbosity=2, exit=False)
@@ -8,10 +8,30 @@ except NameError:
     
 import json
 def __get_dotnet_coe_comm_handler(): 
+    # imported here so that the handler does not depend on names in the user namespace
+    import array
+    import bisect
+    import collections
+    import copy
+    import hashlib
+    import itertools
+    import math
+    import operator
+    import re
+    import reprlib
+    import sys
+    import threading
+    import time
+    import uuid
+    import weakref
+    from concurrent.futures import ThreadPoolExecutor
+    from types import BuiltinFunctionType, FunctionType, ModuleType
 
     class CommandEventCommTarget:
         __control_comm = None
         __coe_handler = None
+        __executor = None
+        __default_max_concurrency = 2
 
         def handle_control_comm_opened(self, comm, msg):
             if comm is None:
@@ -19,9 +39,25 @@ def __get_dotnet_coe_comm_handler():
                 
             self.__control_comm = comm
             self.__control_comm.on_msg(self.handle_control_comm_msg)
+            self.__control_comm.on_close(self.handle_control_comm_closed)
 
-            self.__coe_handler = CommandEventHandler()
-            self.__control_comm.send(self.__coe_handler.is_ready())
+            # heavy commands can be moved off the kernel's message loop when the opener asks for it
+            options = self.__get_comm_data(msg)
+            if (options.get('executionMode') == 'async'):
+                maxConcurrency = options.get('maxConcurrency')
+                if (not isinstance(maxConcurrency, int) or isinstance(maxConcurrency, bool) or maxConcurrency <= 0):
+                    maxConcurrency = self.__default_max_concurrency
+                self.__executor = ThreadPoolExecutor(max_workers=maxConcurrency, thread_name_prefix='dotnet_coe_handler')
+
+            self.__coe_handler = CommandEventHandler(self.__executor, self.__send_all)
+            self.__control_comm.send(self.__coe_handler.is_ready(options))
+
+        def handle_control_comm_closed(self, msg):
+            if (self.__executor is not None):
+                self.__executor.shutdown(wait=True, cancel_futures=True)
+                self.__executor = None
+            if (self.__coe_handler is not None):
+                self.__coe_handler.close()
 
         def handle_control_comm_msg(self, msg):
             # This shouldn't happen unless someone calls this method manually
@@ -29,101 +65,551 @@ def __get_dotnet_coe_comm_handler():
                 raise RuntimeError('Control comm has not been properly opened')
 
             data = msg['content']['data']
-            response = self.__coe_handler.handle_command_or_event(data)
-            self.__control_comm.send(response)
+            buffers = msg.get('buffers')
+            envelops = self.__coe_handler.handle_command_or_event(data, buffers)
+            self.__send_all(envelops)
+
+        def __send_all(self, envelops):
+            for envelop in envelops:
+                self.__send(envelop)
+
+        def __send(self, envelop):
+            # replies are attributed to the command the sending thread is bound to
+            metrics = self.__coe_handler.metrics
+            start = time.perf_counter()
+            try:
+                payload = envelop.payload()
+            except Exception as e:
+                # a value the encoder can not write fails its command, the client would otherwise wait for a reply
+                metrics.log('__send.encodeFailed', e)
+                envelop = EventEnvelope(CommandFailed(f'Failed to encode {envelop.eventType}. {str(e)}'), envelop.command)
+                payload = envelop.payload()
+            buffers = envelop.buffers
+            if (self.__coe_handler.compression is not None):
+                payload, buffers = self.__coe_handler.compression.compress(payload, buffers)
+            sent = time.perf_counter()
+            # the value itself is timed as serialize by the handler, this is the envelope around it
+            metrics.observe('encode', sent - start)
+
+            if (buffers):
+                self.__control_comm.send(payload, buffers=buffers)
+            else:
+                self.__control_comm.send(payload)
+            metrics.observe('send', time.perf_counter() - sent)
+            metrics.observe_payload(len(payload['commandOrEvent'] or '') + sum(memoryview(buffer).nbytes for buffer in buffers))
+            if (isinstance(envelop.event, CommandFailed)):
+                metrics.error()
+            
+        @staticmethod
+        def __get_comm_data(msg):
+            try:
+                return msg['content']['data'] or {}
+            except (TypeError, KeyError):
+                return {}
             
     
     class CommandEventHandler:
-        __exclude_types = ["<class 'module'>", "<class 'builtin_function_or_method'>","<class 'function'>"]
+        __max_value_streams = 16
+        __value_infos_time_budget = 0.5
+        __default_page_size = 1000
+        __async_command_types = ['SendValue', 'RequestValue', 'RequestValues']
 
+        def __init__(self, executor = None, send = None):
+            self.compression = None
+            self.metrics = HandlerMetrics()
+            self.__executor = executor
+            self.__send = send
+            self.__lock = threading.RLock()
+            self.__value_streams = {}
+            self.__types = Envelope.encoder.types
+            self.__value_infos = ValueInfoCache(self.__types)
+            self.__responses = ResponseCache()
+            self.__deltas = DeltaTracker()
+            self.__variables = VariableEnumerator(self.__types)
+            self.__summarizer = ValueSummarizer(self.__types)
+            self.__shared_memory = SharedMemoryTransport()
+            self.__subscription = None
         
-        def handle_command_or_event(self, data):
+        def handle_command_or_event(self, data, buffers = None):
             try:
+                self.metrics.bind(None)
                 msg_type = data['type']
+                start = time.perf_counter()
                 commandOrEvent = json.loads(data['commandOrEvent'])
                 # self.__debugLog('handle_command_or_event.last_data_recv', commandOrEvent)
                 
                 if (msg_type == "command"):
-                    return self.__handle_command(commandOrEvent)
+                    self.metrics.bind(commandOrEvent['commandType'])
+                    self.metrics.count()
+                    self.metrics.observe('parse', time.perf_counter() - start)
+                    return self.__handle_command(commandOrEvent, buffers)
                     
             except Exception as e: 
                 self. __debugLog('handle_command_or_event.commandFailed', e)
-                return EventEnvelope(CommandFailed(f'failed to process comm data. {str(e)}')).payload()
+                return [EventEnvelope(CommandFailed(f'failed to process comm data. {str(e)}'))]
+
+            return []
         
-        def __handle_command(self, commandOrEvent):
+        def __handle_command(self, commandOrEvent, buffers = None):
+            if (self.__executor is not None and commandOrEvent['commandType'] in self.__async_command_types):
+                self.__executor.submit(self.__handle_command_async, commandOrEvent, buffers)
+                return []
+
+            return self.__dispatch_command(commandOrEvent, buffers)
+
+        def __handle_command_async(self, commandOrEvent, buffers):
+            self.metrics.bind(commandOrEvent['commandType'])
+            try:
+                envelops = self.__dispatch_command(commandOrEvent, buffers)
+            except Exception as e:
+                self.__debugLog('__handle_command_async.commandFailed', e)
+                envelops = [EventEnvelope(CommandFailed(f'failed to process comm data. {str(e)}'))]
+
+            # replies can now arrive out of order so every one of them carries its command
+            for envelop in envelops:
+                if (envelop.command is None):
+                    envelop.command = commandOrEvent
+            try:
+                self.__send(envelops)
+            except Exception as e:
+                self.__debugLog('__handle_command_async.sendFailed', e)
+
+        def __dispatch_command(self, commandOrEvent, buffers = None):
             commandType = commandOrEvent['commandType']
 
             envelop = None
             if (commandType == SendValue.__name__):
-                envelop = self.__handle_send_value(commandOrEvent)
+                envelop = self.__handle_send_value(commandOrEvent, buffers)
             elif (commandType == RequestValue.__name__):
                 envelop = self.__handle_request_value(commandOrEvent)
+            elif (commandType == RequestValues.__name__):
+                envelop = self.__handle_request_values(commandOrEvent)
             elif (commandType == RequestValueInfos.__name__):
                 envelop = self.__handle_request_value_infos(commandOrEvent)
+            elif (commandType == AcknowledgeValueChunk.__name__):
+                envelop = self.__handle_acknowledge_value_chunk(commandOrEvent)
+            elif (commandType == CancelValueStream.__name__):
+                envelop = self.__handle_cancel_value_stream(commandOrEvent)
+            elif (commandType == ReleaseSharedMemory.__name__):
+                envelop = self.__handle_release_shared_memory(commandOrEvent)
+            elif (commandType == RequestDiagnostics.__name__):
+                envelop = self.__handle_request_diagnostics(commandOrEvent)
+            elif (commandType == SubscribeValueInfos.__name__):
+                envelop = self.__handle_subscribe_value_infos(commandOrEvent)
+            elif (commandType == UnsubscribeValueInfos.__name__):
+                envelop = self.__handle_unsubscribe_value_infos(commandOrEvent)
             else: 
                 envelop = EventEnvelope(CommandFailed(f'command "{commandType}" not supported'))
 
-            return envelop.payload()
+            return envelop if isinstance(envelop, list) else [envelop]
 
         def __handle_request_value_infos(self, command):
-            results_who_ls = get_ipython().run_line_magic('who_ls', '')
+            requestValueInfos = RequestValueInfos(command['command'])
+            sinceGeneration = getattr(requestValueInfos, 'sinceGeneration', None)
+            namePrefix = getattr(requestValueInfos, 'namePrefix', None)
+            typeNames = getattr(requestValueInfos, 'types', None)
+            if (sinceGeneration is None):
+                entries = self.__refresh_value_infos(namePrefix, typeNames)
+                return EventEnvelope(ValueInfosProduced(RawJson.array([info for info, _ in entries if info is not None])), command)
+
+            results, generation, removedNames = self.__value_infos_since(sinceGeneration, namePrefix, typeNames)
+            return EventEnvelope(ValueInfosProduced(RawJson.array(results), generation, removedNames), command)
+
+        def __refresh_value_infos(self, namePrefix = None, typeNames = None):
+            start = time.perf_counter()
             variables = globals()
-            results = []
-            for x in results_who_ls:
-                valueType = str(type(variables[x]))
-                if (x in variables and valueType not in self.__exclude_types):
-                    try:
-                        formattedValue = FormattedValue('text/plain+summary', f'{variables[x]}')
-                        results.append(KernelValueInfo(x, formattedValue, valueType))
-                    except Exception as error: 
-                        self. __debugLog('failed creating formattedValue for ' +x+ ' of type ' +valueType, error)
-                        pass
+            names = self.__variables.names(get_ipython(), variables, namePrefix, typeNames)
+            self.metrics.observe('lookup', time.perf_counter() - start)
+
+            start = time.perf_counter()
+            deadline = start + self.__value_infos_time_budget
+            # a filtered request only sees part of the namespace, names outside of it are not removed
+            partial = bool(namePrefix or typeNames)
+            entries = self.__value_infos.refresh(names, variables, self.__create_value_info, deadline, partial)
+            self.metrics.observe('serialize', time.perf_counter() - start)
+            return entries
 
-            return EventEnvelope(ValueInfosProduced(results), command)
+        def __value_infos_since(self, sinceGeneration, namePrefix = None, typeNames = None):
+            entries = self.__refresh_value_infos(namePrefix, typeNames)
+            results = [info for info, generation in entries if info is not None and generation > sinceGeneration]
+            removedNames = self.__value_infos.removed_since(sinceGeneration)
+            return results, self.__value_infos.generation, removedNames
+
+        def __handle_subscribe_value_infos(self, command):
+            # the subscriber gets the current value infos in the reply and, after every cell that ran,
+            # a ValueInfosChanged event with only the names added, rebound or removed since then
+            subscribeValueInfos = SubscribeValueInfos(command['command'])
+            namePrefix = getattr(subscribeValueInfos, 'namePrefix', None)
+            typeNames = getattr(subscribeValueInfos, 'types', None)
+            if (self.__send is None):
+                return EventEnvelope(CommandFailed('Value infos can only be pushed over an open comm.'), command)
+
+            with self.__lock:
+                results, generation, removedNames = self.__value_infos_since(-1, namePrefix, typeNames)
+                if (self.__subscription is None):
+                    get_ipython().events.register('post_run_cell', self.__on_post_run_cell)
+                self.__subscription = { 'namePrefix': namePrefix, 'types': typeNames, 'generation': generation }
+            return EventEnvelope(ValueInfosProduced(RawJson.array(results), generation, []), command)
+
+        def __handle_unsubscribe_value_infos(self, command):
+            self.__unsubscribe()
+            return EventEnvelope(CommandSucceeded(), command)
+
+        def __unsubscribe(self):
+            with self.__lock:
+                if (self.__subscription is not None):
+                    get_ipython().events.unregister('post_run_cell', self.__on_post_run_cell)
+                    self.__subscription = None
+
+        def __on_post_run_cell(self, result = None):
+            # runs on the kernel's main thread after each cell, nothing may escape into the user's cell output
+            self.metrics.bind(SubscribeValueInfos.__name__)
+            try:
+                with self.__lock:
+                    subscription = self.__subscription
+                    if (subscription is None):
+                        return
+                    results, generation, removedNames = self.__value_infos_since(subscription['generation'], subscription['namePrefix'], subscription['types'])
+                    subscription['generation'] = generation
+                if (results or removedNames):
+                    self.__send([EventEnvelope(ValueInfosChanged(RawJson.array(results), generation, removedNames))])
+            except Exception as e:
+                self.__debugLog('__on_post_run_cell.failed', e)
+
+        def __create_value_info(self, name, value, placeholder = False):
+            # value infos are kept encoded, a reply only joins the ones it sends instead of encoding each again
+            valueType = str(type(value))
+            try:
+                start = time.perf_counter()
+                summary = self.__summarizer.placeholder(value) if placeholder else self.__summarizer.summarize(value)
+                formattedValue = FormattedValue('text/plain+summary', summary)
+                info = RawJson(Envelope.encoder.dumps(KernelValueInfo(name, formattedValue, valueType)))
+                self.metrics.observe_value(type(value), time.perf_counter() - start)
+                return info
+            except Exception as error: 
+                self. __debugLog('failed creating formattedValue for ' +name+ ' of type ' +valueType, error)
+                return None
             
         def __handle_request_value(self, command):
-            requestValue = RequestValue(command['command'])
+            return self.__request_value(RequestValue(command['command']), command)
+
+        def __handle_request_values(self, command):
+            # every requested value is answered by a ValuesProduced entry, failures included, so one missing
+            # variable does not fail the whole batch. in stream mode each entry is sent as soon as it is ready.
+            requestValues = RequestValues(command['command'])
+            stream = getattr(requestValues, 'mode', 'batch') == 'stream'
+            values = []
+            buffers = []
+            envelops = []
+            for entries in requestValues.requests:
+                requestValue = RequestValue(entries)
+                if (getattr(requestValue, 'chunkSize', None) is not None):
+                    envelop = EventEnvelope(CommandFailed(f'Cannot stream "{requestValue.name}" as chunks in a batch.'), command)
+                else:
+                    try:
+                        envelop = self.__request_value(requestValue, command)
+                    except Exception as e:
+                        self.__debugLog('__handle_request_values.error', e)
+                        envelop = EventEnvelope(CommandFailed(f'Failed to produce value for "{requestValue.name}". {str(e)}'), command)
+
+                value = self.__to_batch_value(envelop, len(buffers))
+                if (stream):
+                    envelop = EventEnvelope(ValuesProduced([value]), command, envelop.buffers)
+                    if (self.__send is not None):
+                        self.__send([envelop])
+                    else:
+                        envelops.append(envelop)
+                else:
+                    values.append(value)
+                    buffers.extend(envelop.buffers)
+
+            if (stream):
+                return envelops + [EventEnvelope(CommandSucceeded(), command)]
+            return EventEnvelope(ValuesProduced(values), command, buffers)
+
+        @staticmethod
+        def __to_batch_value(envelop, bufferOffset):
+            # buffer indices point into the buffers of the single value and are moved past the ones already batched
+            event = envelop.event
+            if (isinstance(event, ValueProduced) and envelop.buffers and bufferOffset > 0):
+                event = copy.copy(event)
+                if (event.formattedValue.mimeType == TypedArrays.mimeType):
+                    event.value = TypedArrays.rebase(event.value, bufferOffset)
+                    event.formattedValue = FormattedValue(TypedArrays.mimeType, Envelope.encoder.dumps(event.value))
+                else:
+                    event.value = dict(event.value, bufferIndex=event.value['bufferIndex'] + bufferOffset)
+            return { 'eventType': envelop.eventType, 'event': event }
+
+        def __request_value(self, requestValue, command):
             name = requestValue.name
-            mimeType = requestValue.mimeType
             
+            start = time.perf_counter()
             if (name not in globals()):
                 return EventEnvelope(CommandFailed(f'Variable "{name}" not found.'))
             
             rawValue = globals()[name]
-            updatedValue = None
+            kind = self.__types.kind(rawValue)
+            self.metrics.observe('lookup', time.perf_counter() - start)
 
-            try: 
-                import pandas as pd; 
-                if (isinstance(rawValue, pd.DataFrame)):
-                    mimeType = 'application/table-schema+json'
-                    updatedValue = rawValue.to_dict('records')
-            except Exception as e: 
-                self. __debugLog('__handle_request_value.dataframe.error', e)
-                pass
+            if (getattr(requestValue, 'delta', False)):
+                return self.__handle_request_value_delta(name, rawValue, kind, requestValue, command)
+
+            if (any(getattr(requestValue, field, None) is not None for field in ['offset', 'limit', 'columns'])):
+                return self.__handle_request_value_page(name, rawValue, kind, requestValue, command)
+
+            return self.__produce_value(name, rawValue, kind, requestValue, command)
 
-            formattedValue = FormattedValue.fromValue(rawValue, mimeType) 
+        def __handle_request_value_delta(self, name, rawValue, kind, requestValue, command):
+            # the client names the version it holds, only what changed since is sent
+            if (requestValue.mimeType != 'application/json'):
+                return EventEnvelope(CommandFailed(f'Cannot send "{name}" as a delta. Only application/json is supported.'), command)
 
-            return EventEnvelope(ValueProduced(name, rawValue if updatedValue is None else updatedValue, formattedValue), command)
+            start = time.perf_counter()
+            try:
+                version, baseVersion, operation, changes = self.__deltas.delta(name, rawValue, kind, getattr(requestValue, 'baseVersion', None))
+                # a replace holds the value itself, it is encoded here so a value json can not encode fails the command
+                changes = RawJson(Envelope.encoder.dumps(changes))
+            except Exception as e:
+                self.__debugLog('__handle_request_value.delta.error', e)
+                return EventEnvelope(CommandFailed(f'Cannot compute a delta for "{name}". {str(e)}'), command)
+            self.metrics.observe('serialize', time.perf_counter() - start)
+
+            return EventEnvelope(ValueDeltaProduced(name, version, baseVersion, operation, changes), command)
+
+        def __handle_request_value_page(self, name, rawValue, kind, requestValue, command):
+            # only the requested window is cut from the value, the rest of it is never serialized
+            offset = getattr(requestValue, 'offset', None) or 0
+            limit = getattr(requestValue, 'limit', None)
+            limit = self.__default_page_size if limit is None else limit
+            if (not isinstance(offset, int) or not isinstance(limit, int) or offset < 0 or limit < 0):
+                return EventEnvelope(CommandFailed(f'Invalid page offset "{offset}" or limit "{limit}" for: "{name}".'), command)
+            if (getattr(requestValue, 'chunkSize', None) is not None):
+                return EventEnvelope(CommandFailed(f'Cannot stream a page of "{name}" as chunks.'), command)
+
+            try:
+                page, totalCount = ValuePage.slice(rawValue, kind, offset, limit, getattr(requestValue, 'columns', None))
+            except Exception as e:
+                self.__debugLog('__handle_request_value.page.error', e)
+                return EventEnvelope(CommandFailed(f'Cannot read a page of "{name}". {str(e)}'), command)
+
+            envelop = self.__produce_value(name, page, self.__types.kind(page), requestValue, command, cacheable=False)
+            if (not isinstance(envelop.event, ValueProduced)):
+                return envelop
+            event = envelop.event
+            return EventEnvelope(ValuePageProduced(name, event.value, event.formattedValue, offset, totalCount), command, envelop.buffers)
+
+        def __produce_value(self, name, rawValue, kind, requestValue, command, cacheable = True):
+            mimeType = requestValue.mimeType
+            if (mimeType == 'application/vnd.apache.arrow.stream'):
+                return self.__handle_request_value_as_arrow_stream(name, rawValue, kind, command)
+
+            if (mimeType == SharedMemoryTransport.mimeType):
+                return self.__handle_request_value_as_shared_memory(name, rawValue, kind, command)
+
+            if (mimeType == TypedArrays.mimeType):
+                return self.__handle_request_value_as_typed_buffers(name, rawValue, kind, command)
+
+            chunkSize = getattr(requestValue, 'chunkSize', None)
+            if (chunkSize is not None):
+                return self.__handle_request_value_as_chunks(name, rawValue, kind, mimeType, chunkSize, getattr(requestValue, 'window', None), command)
+
+            # the encoded value is reused while the variable is bound to the same unchanged object,
+            # a client that already holds that version only gets told that it did not change
+            # the version costs a pass over the data, it is skipped when the response could not be cached
+            # anyway unless the client can use it to skip the transfer
+            cacheable = cacheable and (hasattr(requestValue, 'ifNoneMatch') or self.__responses.fits(name, mimeType, rawValue, kind))
+            version = ResponseCache.version(rawValue, kind) if cacheable else None
+            etag = None if version is None else ResponseCache.etag(version)
+            if (etag is not None and getattr(requestValue, 'ifNoneMatch', None) == etag):
+                return EventEnvelope(ValueUnchanged(name, etag), command)
+
+            start = time.perf_counter()
+            response = None if version is None else self.__responses.get(name, mimeType, rawValue, version)
+            if (response is None):
+                # dataframes are written as records by the envelope encoder
+                valueJson = RawJson(Envelope.encoder.dumps(rawValue))
+                if (mimeType == 'application/json' and kind != 'dataframe'):
+                    formattedValue = FormattedValue(mimeType, valueJson.text)
+                else:
+                    formattedValue = FormattedValue.fromValue(rawValue, mimeType, kind) 
+                response = (valueJson, formattedValue)
+                if (version is not None):
+                    self.__responses.put(name, mimeType, rawValue, version, response, len(valueJson.text) + len(formattedValue.value or ''))
+            elapsed = time.perf_counter() - start
+            self.metrics.observe('serialize', elapsed)
+            self.metrics.observe_value(type(rawValue), elapsed)
+
+            event = ValueProduced(name, response[0], response[1])
+            if (etag is not None and hasattr(requestValue, 'ifNoneMatch')):
+                event.etag = etag
+            return EventEnvelope(event, command)
         
-        def __handle_send_value(self, command):
+        def __handle_request_value_as_arrow_stream(self, name, rawValue, kind, command):
+            # the table is written as arrow record batches into a comm buffer so that
+            # no per row objects are created, the value only points at the buffer holding it.
+            if (kind not in ['dataframe', 'polars.dataframe', 'arrow.table']):
+                return EventEnvelope(CommandFailed(f'Cannot send "{name}" as an arrow stream. Only pandas, polars and pyarrow tables are supported.'))
+
+            try:
+                import pyarrow as pa
+                if (kind == 'dataframe'):
+                    table = pa.Table.from_pandas(rawValue, preserve_index=False)
+                elif (kind == 'polars.dataframe'):
+                    table = rawValue.to_arrow()
+                else:
+                    table = rawValue
+                sink = pa.BufferOutputStream()
+                with pa.ipc.new_stream(sink, table.schema) as writer:
+                    writer.write_table(table)
+                stream = sink.getvalue()
+            except Exception as e:
+                self.__debugLog('__handle_request_value.arrow.error', e)
+                return EventEnvelope(CommandFailed(f'Cannot create arrow stream for: "{name}". {str(e)}'))
+
+            preview = rawValue.to_string(index=False, max_rows=5) if kind == 'dataframe' else self.__summarizer.summarize(rawValue)
+            formattedValue = FormattedValue('application/vnd.apache.arrow.stream', preview)
+            return EventEnvelope(ValueProduced(name, { 'bufferIndex': 0 }, formattedValue), command, [memoryview(stream)])
+
+        def __handle_request_value_as_typed_buffers(self, name, rawValue, kind, command):
+            try:
+                descriptor, buffers = TypedArrays.to_buffers(*TypedArrays.from_value(rawValue, kind))
+            except Exception as e:
+                self.__debugLog('__handle_request_value.typed_buffers.error', e)
+                return EventEnvelope(CommandFailed(f'Cannot send "{name}" as typed buffers. {str(e)}'), command)
+
+            formattedValue = FormattedValue(TypedArrays.mimeType, Envelope.encoder.dumps(descriptor))
+            return EventEnvelope(ValueProduced(name, descriptor, formattedValue), command, buffers)
+
+        def __handle_request_value_as_shared_memory(self, name, rawValue, kind, command):
+            try:
+                descriptor = self.__shared_memory.export(rawValue, kind)
+            except Exception as e:
+                self.__debugLog('__handle_request_value.shared_memory.error', e)
+                return EventEnvelope(CommandFailed(f'Cannot share "{name}" through shared memory. {str(e)}'), command)
+
+            formattedValue = FormattedValue(SharedMemoryTransport.mimeType, Envelope.encoder.dumps(descriptor))
+            return EventEnvelope(ValueProduced(name, descriptor, formattedValue), command)
+
+        def __handle_request_diagnostics(self, command):
+            requestDiagnostics = RequestDiagnostics(command['command'])
+            diagnostics = self.metrics.snapshot()
+            if (getattr(requestDiagnostics, 'reset', False)):
+                self.metrics.reset()
+            return EventEnvelope(DiagnosticsProduced(diagnostics['commands'], diagnostics['valueTypes'], diagnostics['log']), command)
+
+        def __handle_release_shared_memory(self, command):
+            releaseSharedMemory = ReleaseSharedMemory(command['command'])
+            if (not self.__shared_memory.release(releaseSharedMemory.segment)):
+                return EventEnvelope(CommandFailed(f'Shared memory segment "{releaseSharedMemory.segment}" not found.'), command)
+            return EventEnvelope(CommandSucceeded(), command)
+
+        def __handle_request_value_as_chunks(self, name, rawValue, kind, mimeType, chunkSize, window, command):
+            if (not isinstance(chunkSize, int) or chunkSize <= 0):
+                return EventEnvelope(CommandFailed(f'Invalid chunk size "{chunkSize}" for: "{name}".'), command)
+
+            # the formatted value is only produced for dataframes, anything else would need the full value serialized
+            formattedValue = FormattedValue(mimeType)
+            if (kind == 'dataframe'):
+                try:
+                    formattedValue = FormattedValue('application/table-schema+json', rawValue.to_string(index=False, max_rows=5))
+                except Exception as e: 
+                    self. __debugLog('__handle_request_value.dataframe.error', e)
+
+            token = command.get('token')
+            with self.__lock:
+                if (token in self.__value_streams):
+                    self.__value_streams.pop(token).close()
+                elif (len(self.__value_streams) >= self.__max_value_streams):
+                    # streams that are never acknowledged would otherwise hold on to their value forever
+                    self.__value_streams.pop(next(iter(self.__value_streams))).close()
+
+                stream = ValueStream(name, ValueStream.chunks(ValueStream.json_pieces(rawValue, kind), chunkSize), formattedValue, command, window)
+                self.__value_streams[token] = stream
+                return self.__next_value_chunks(token)
+
+        def __handle_acknowledge_value_chunk(self, command):
+            acknowledgeValueChunk = AcknowledgeValueChunk(command['command'])
+            token = acknowledgeValueChunk.streamToken
+            with self.__lock:
+                if (token not in self.__value_streams):
+                    return EventEnvelope(CommandFailed(f'Value stream "{token}" not found.'), command)
+
+                self.__value_streams[token].acknowledge(acknowledgeValueChunk.sequence)
+                return self.__next_value_chunks(token)
+
+        def __handle_cancel_value_stream(self, command):
+            cancelValueStream = CancelValueStream(command['command'])
+            token = cancelValueStream.streamToken
+            with self.__lock:
+                if (token not in self.__value_streams):
+                    return EventEnvelope(CommandFailed(f'Value stream "{token}" not found.'), command)
+
+                self.__value_streams.pop(token).close()
+            return EventEnvelope(CommandSucceeded(), command)
+
+        def __next_value_chunks(self, token):
+            with self.__lock:
+                stream = self.__value_streams[token]
+                try:
+                    envelops = stream.next_envelops()
+                except Exception as e:
+                    self.__debugLog('__next_value_chunks.error', e)
+                    self.__value_streams.pop(token).close()
+                    return EventEnvelope(CommandFailed(f'Failed to stream value for: "{stream.name}". {str(e)}'), stream.command)
+
+                if (stream.completed):
+                    self.__value_streams.pop(token)
+                return envelops
+
+        def __handle_send_value(self, command, buffers = None):
             sendValue = SendValue(command['command'])
             mimeType = sendValue.formattedValue['mimeType']
             name = sendValue.name
             rawValue = sendValue.formattedValue['value']
+            # tables arrive as pandas dataframes unless the sender names 'polars' or 'pyarrow'
+            targetType = getattr(sendValue, 'targetType', None)
             resultValue = None
             
             if (not str.isidentifier(name)):
                 return EventEnvelope(CommandFailed(f'Invalid Identifier: "{name}"'))
         
             if (mimeType == 'application/json'):
-                import json; resultValue = json.loads(rawValue)
+                resultValue = json.loads(rawValue)
             elif (mimeType == 'application/table-schema+json'):
-                import json; resultValue = json.loads(rawValue)
+                resultValue = json.loads(rawValue)
                 try:
-                    import pandas as pd; resultValue = pd.DataFrame(data=resultValue['data'])
+                    resultValue = TabularDataResourceReader.to_dataframe(resultValue)
                 except Exception as e:
                     self.__debugLog('__handle_send_value.dataframe.error', e)
                     return EventEnvelope(CommandFailed(f'Cannot create pandas dataframe for: "{name}". {str(e)}'))
+            elif (mimeType == 'application/vnd.apache.arrow.stream'):
+                if (not buffers):
+                    return EventEnvelope(CommandFailed(f'Cannot create pandas dataframe for: "{name}". No arrow stream buffer received.'))
+                try:
+                    import pyarrow as pa; table = pa.ipc.open_stream(pa.py_buffer(buffers[0])).read_all()
+                    if (targetType == 'pyarrow'):
+                        resultValue = table
+                    elif (targetType == 'polars'):
+                        import polars as pl; resultValue = pl.from_arrow(table)
+                    else:
+                        resultValue = table.to_pandas()
+                except Exception as e:
+                    self.__debugLog('__handle_send_value.arrow.error', e)
+                    return EventEnvelope(CommandFailed(f'Cannot create pandas dataframe for: "{name}". {str(e)}'))
+            elif (mimeType == SharedMemoryTransport.mimeType):
+                try:
+                    resultValue = SharedMemoryTransport.read(json.loads(rawValue), targetType)
+                except Exception as e:
+                    self.__debugLog('__handle_send_value.shared_memory.error', e)
+                    return EventEnvelope(CommandFailed(f'Cannot read "{name}" from shared memory. {str(e)}'))
+            elif (mimeType == TypedArrays.mimeType):
+                if (not buffers):
+                    return EventEnvelope(CommandFailed(f'Cannot create value for: "{name}". No typed buffers received.'))
+                try:
+                    resultValue = TypedArrays.from_buffers(json.loads(rawValue), buffers, targetType)
+                except Exception as e:
+                    self.__debugLog('__handle_send_value.typed_buffers.error', e)
+                    return EventEnvelope(CommandFailed(f'Cannot create value for: "{name}". {str(e)}'))
                 
             if (resultValue is not None): 
                 self.__setVariable(name, resultValue) 
@@ -131,98 +617,1351 @@ def __get_dotnet_coe_comm_handler():
             
             return EventEnvelope(CommandFailed(f'Failed to set value for "{name}". "{mimeType}" mimetype not supported.'))
         
-        def is_ready(self):
-            return EventEnvelope(KernelReady()).payload()
+        def is_ready(self, capabilities = None):
+            # the opener lists the compression codecs it can read, the first one available here is used
+            accepted = None
+            if (capabilities and 'compression' in capabilities):
+                self.compression = PayloadCompression.negotiate(capabilities.get('compression'), capabilities.get('compressionThreshold'))
+                accepted = {} if self.compression is None else self.compression.capabilities()
+            return EventEnvelope(KernelReady(capabilities=accepted)).payload()
         
-        @staticmethod
-        def __setVariable(name, value):
+        def close(self):
+            self.__unsubscribe()
+            with self.__lock:
+                for stream in self.__value_streams.values():
+                    stream.close()
+                self.__value_streams.clear()
+            self.__shared_memory.release_all()
+        
+        def __setVariable(self, name, value):
             globals()[name] = value
+            self.__value_infos.evict(name)
+            self.__responses.evict(name)
         
-        @staticmethod
-        def __debugLog(event, message):
-            globals()[f'__log__coe_handler.{str(event)}'] = message
+        def __debugLog(self, event, message):
+            self.metrics.log(event, message)
     
     
-    class KernelCommand: 
-        pass
+    class Message:
+        # messages keep their fields in slots and are written by an encoder the json encoder builds once
+        # per class from them. optional fields are left out of the json while they are None.
+        __slots__ = ()
+        optional = ()
+        __fields = {}
+
+        @classmethod
+        def fields(cls):
+            fields = Message.__fields.get(cls)
+            if (fields is None):
+                fields = Message.__fields[cls] = tuple(name for base in reversed(cls.__mro__) for name in base.__dict__.get('__slots__', ()))
+            return fields
+
+    class KernelCommand(Message):
+        # only the fields that were sent are set, a missing one is read with getattr and a default
+        __slots__ = ()
 
-    class SendValue(KernelCommand): 
         def __init__(self, entries):
-            self.__dict__.update(**entries)
+            for name in self.fields():
+                if (name in entries):
+                    setattr(self, name, entries[name])
+
+    class SendValue(KernelCommand): 
+        __slots__ = ('name', 'formattedValue', 'targetType')
 
     class RequestValue(KernelCommand):
-        def __init__(self, entries):
-            self.__dict__.update(**entries)
+        __slots__ = ('name', 'mimeType', 'chunkSize', 'window', 'offset', 'limit', 'columns', 'ifNoneMatch', 'delta', 'baseVersion')
+
+    class RequestValues(KernelCommand):
+        __slots__ = ('requests', 'mode')
 
     class RequestValueInfos(KernelCommand):
-        def __init__(self, entries):
-            self.__dict__.update(**entries)
+        __slots__ = ('sinceGeneration', 'namePrefix', 'types')
             
-    class FormattedValue:
+    class AcknowledgeValueChunk(KernelCommand):
+        __slots__ = ('streamToken', 'sequence')
+
+    class CancelValueStream(KernelCommand):
+        __slots__ = ('streamToken',)
+
+    class ReleaseSharedMemory(KernelCommand):
+        __slots__ = ('segment',)
+
+    class RequestDiagnostics(KernelCommand):
+        __slots__ = ('reset',)
+
+    class SubscribeValueInfos(KernelCommand):
+        __slots__ = ('namePrefix', 'types')
+
+    class UnsubscribeValueInfos(KernelCommand):
+        __slots__ = ()
+
+    class ValueInfoCache:
+        # value infos are reused while a variable is bound to the same object with the same fingerprint.
+        # values are only weakly referenced, the ones that can not be, and kinds whose content has no cheap
+        # digest, are summarized again on every refresh. the generation is bumped on every refresh that
+        # observes a changed value info so that clients can ask for what changed since the last one they saw.
+        __reusable_kinds = ('dataframe', 'series', 'ndarray', 'arrow.table')
+        __shown_items = 5
+
+        def __init__(self, types):
+            self.generation = 0
+            self.__types = types
+            self.__lock = threading.Lock()
+            self.__entries = {}
+            self.__removed = {}
+
+        def fingerprint(self, value):
+            kind = self.__types.kind(value)
+            if (kind not in self.__reusable_kinds):
+                return None
+            try:
+                weakref.ref(value)
+                # arrow tables can not be changed in place
+                digest = '' if kind == 'arrow.table' else self.__shown_digest(value, kind)
+                return None if digest is None else (type(value), str(value.shape), str(getattr(value, 'dtype', None)), digest)
+            except Exception:
+                return None
+
+        def __shown_digest(self, value, kind):
+            # the summary only shows the first and last rows and columns, a change to any of them changes the digest
+            np = sys.modules['numpy']
+            digest = hashlib.blake2b(digest_size=16)
+            if (kind == 'ndarray'):
+                if (value.dtype.kind not in 'biufcmM'):
+                    return None
+                shown = value[np.ix_(*[self.__shown(length) for length in value.shape])] if value.ndim else value
+                digest.update(np.ascontiguousarray(shown).tobytes())
+            else:
+                rows = self.__shown(len(value))
+                shown = value.iloc[rows] if kind == 'series' else value.iloc[rows, self.__shown(value.shape[1])]
+                digest.update(sys.modules['pandas'].util.hash_pandas_object(shown, index=True).to_numpy().tobytes())
+                digest.update(repr(value.name if kind == 'series' else shown.columns.tolist()).encode('utf-8'))
+            return digest.hexdigest()
+
+        def __shown(self, length):
+            np = sys.modules['numpy']
+            if (length <= 2 * self.__shown_items):
+                return np.arange(length)
+            return np.r_[0:self.__shown_items, length - self.__shown_items:length]
+
+        def refresh(self, names, variables, create_info, deadline = None, partial = False):
+            with self.__lock:
+                changes = {}
+                for name in names:
+                    value = variables[name]
+                    fingerprint = self.fingerprint(value)
+                    entry = self.__entries.get(name)
+                    if (entry is not None and fingerprint is not None and entry[0] == id(value) and entry[2] == fingerprint and entry[1]() is value):
+                        continue
+
+                    if (deadline is not None and time.perf_counter() > deadline):
+                        # out of time, the same object keeps its last value info until the next refresh and
+                        # anything else gets a placeholder that is not fingerprinted so the next refresh replaces it
+                        if (entry is not None and entry[0] == id(value)):
+                            continue
+                        fingerprint, info = None, create_info(name, value, True)
+                    else:
+                        info = create_info(name, value)
+                    ref = None if fingerprint is None else weakref.ref(value)
+                    if (entry is not None and self.__text(entry[3]) == self.__text(info)):
+                        # summarized again to the same value info, the variable did not change
+                        self.__entries[name] = (id(value), ref, fingerprint, entry[3], entry[4])
+                    else:
+                        changes[name] = (id(value), ref, fingerprint, info)
+
+                current = set(names)
+                removedNames = [name for name in self.__entries if name not in current and (not partial or name not in variables)]
+                if (changes or removedNames):
+                    self.generation += 1
+                    for name in removedNames:
+                        del self.__entries[name]
+                        self.__removed[name] = self.generation
+                    for name, (valueId, ref, fingerprint, info) in changes.items():
+                        self.__entries[name] = (valueId, ref, fingerprint, info, self.generation)
+                        self.__removed.pop(name, None)
+
+                return [(self.__entries[name][3], self.__entries[name][4]) for name in names]
+
+        @staticmethod
+        def __text(info):
+            return None if info is None else info.text
+
+        def removed_since(self, generation):
+            with self.__lock:
+                return [name for name, removedAt in self.__removed.items() if removedAt > generation]
+
+        def evict(self, name):
+            with self.__lock:
+                self.__entries.pop(name, None)
+
+    class VariableEnumerator:
+        # user variables are found in a single pass over the namespace, leaving out the names %who_ls
+        # leaves out: the ones starting with an underscore and the ones ipython put there itself. the
+        # type filter matches value kinds or qualified type names, the name is only built when the kind
+        # does not match.
+        __exclude_types = (ModuleType, BuiltinFunctionType, FunctionType)
+
+        def __init__(self, types):
+            self.__types = types
+
+        def names(self, shell, variables, namePrefix = None, typeNames = None):
+            namespace = shell.user_ns
+            hidden = shell.user_ns_hidden
+            prefix = namePrefix or ''
+            wanted = set(typeNames) if typeNames else None
+            names = []
+            for name, value in list(namespace.items()):
+                if (name[:1] == '_' or not name.startswith(prefix)):
+                    continue
+                if (name in hidden and hidden[name] is value):
+                    continue
+                if (namespace is not variables):
+                    value = variables.get(name, self)
+                    if (value is self):
+                        continue
+                valueType = type(value)
+                if (valueType in self.__exclude_types):
+                    continue
+                if (wanted is not None and self.__types.kind(value) not in wanted and f'{valueType.__module__}.{valueType.__qualname__}' not in wanted):
+                    continue
+                names.append(name)
+            names.sort()
+            return names
+
+    class ValueTypeRegistry:
+        # a registered type gives the kind of its values and the serializer that converts them for json,
+        # the kind decides how they are summarized, formatted and streamed. the first registered type a
+        # value is an instance of is resolved once per concrete type. registered types are looked up in
+        # sys.modules so probing for an optional library never imports it and a kernel without pandas
+        # pays nothing for its entries. classes redefined in cells are new types every time, only the
+        # most recently resolved ones are kept.
+        __max_types = 1024
+
+        def __init__(self, encoder):
+            self.__entries = []
+            self.__summarizers = {}
+            self.__by_type = {}
+            self.__lock = threading.Lock()
+            self.__register_defaults(encoder)
+
+        def register(self, moduleName, typeName, kind = None, serializer = None):
+            with self.__lock:
+                self.__entries.insert(0, (moduleName, typeName, kind, serializer))
+                self.__by_type = {}
+
+        def register_summarizer(self, kind, summarizer):
+            self.__summarizers[kind] = summarizer
+
+        def kind(self, value):
+            return self.__resolve(type(value))[0]
+
+        def serializer(self, valueType):
+            return self.__resolve(valueType)[1]
+
+        def summarizer(self, kind):
+            return self.__summarizers.get(kind)
+
+        def __resolve(self, valueType):
+            entry = self.__by_type.get(valueType)
+            if (entry is None):
+                entry = self.__find(valueType)
+                with self.__lock:
+                    if (len(self.__by_type) >= self.__max_types):
+                        del self.__by_type[next(iter(self.__by_type))]
+                    self.__by_type[valueType] = entry
+            return entry
+
+        def __find(self, valueType):
+            for moduleName, typeName, kind, serializer in self.__entries:
+                module = sys.modules.get(moduleName)
+                registeredType = getattr(module, typeName, None) if module is not None else None
+                if (isinstance(registeredType, type) and issubclass(valueType, registeredType)):
+                    return (kind, serializer)
+            return (None, None)
+
+        def __register_defaults(self, encoder):
+            # numpy scalars such as float64 or str_ that derive from a builtin type are of its kind
+            self.register('numpy', 'generic', 'scalar', lambda value: encoder.convert_ndarray(sys.modules['numpy'].asarray(value)))
+            for typeName in ['bool', 'int', 'float', 'complex']:
+                self.register('builtins', typeName, 'scalar')
+            for typeName in ['str', 'bytes', 'bytearray']:
+                self.register('builtins', typeName, 'text')
+            for typeName in ['list', 'tuple', 'dict']:
+                self.register('builtins', typeName, 'collection')
+            for typeName in ['set', 'frozenset']:
+                self.register('builtins', typeName, 'collection', list)
+            self.register('uuid', 'UUID', serializer=str)
+            self.register('decimal', 'Decimal', serializer=lambda value: RawJson(str(value)) if value.is_finite() else None)
+            self.register('datetime', 'date', serializer=lambda value: value.isoformat())
+            self.register('datetime', 'time', serializer=lambda value: value.isoformat())
+            self.register('numpy', 'ndarray', 'ndarray', encoder.convert_ndarray)
+            self.register('pandas', 'Series', 'series', encoder.convert_series)
+            self.register('pandas', 'DataFrame', 'dataframe', encoder.convert_dataframe)
+            self.register('pyarrow', 'Array', serializer=lambda value: value.to_pylist())
+            self.register('pyarrow', 'ChunkedArray', serializer=lambda value: value.to_pylist())
+            self.register('pyarrow', 'Table', 'arrow.table', lambda value: value.to_pylist())
+            self.register('polars', 'Series', serializer=lambda value: value.to_list())
+            self.register('polars', 'DataFrame', 'polars.dataframe', lambda value: value.to_dicts())
+
+    class ResponseCache:
+        # encoded responses are keyed by variable name and mime type and are only reused for the same
+        # object at the same version. versions exist for values with a cheap content hash, anything else
+        # is encoded on every request. the least recently used responses go once the cap is exceeded.
+        __default_max_bytes = 64 * 2**20
+
+        def __init__(self, maxBytes = None):
+            self.__max_bytes = maxBytes or self.__default_max_bytes
+            self.__lock = threading.Lock()
+            self.__entries = collections.OrderedDict()
+            self.__oversized = {}
+            self.__size = 0
+
+        @staticmethod
+        def version(value, kind):
+            try:
+                if (kind == 'dataframe'):
+                    return (id(value), value.shape, tuple(map(str, value.columns)), tuple(map(str, value.dtypes)), ResponseCache.__rows_digest(value))
+                if (kind == 'series'):
+                    return (id(value), len(value), str(value.name), str(value.dtype), ResponseCache.__rows_digest(value))
+                if (kind == 'ndarray' and value.dtype.kind in 'biufcmM'):
+                    np = sys.modules['numpy']
+                    digest = hashlib.blake2b(np.ascontiguousarray(value).reshape(-1).view(np.uint8), digest_size=16).hexdigest()
+                    return (id(value), value.shape, value.dtype.str, digest)
+                if (kind == 'arrow.table'):
+                    # arrow tables can not be changed in place
+                    return (id(value), value.num_rows)
+                if (type(value) in [str, bytes]):
+                    return (type(value).__name__, len(value), hash(value))
+            except Exception:
+                pass
+            return None
+
+        @staticmethod
+        def __rows_digest(value):
+            # the row hashes are digested in order, a sorted or shuffled frame gets a new version
+            rowHashes = sys.modules['pandas'].util.hash_pandas_object(value, index=True).to_numpy()
+            return hashlib.blake2b(memoryview(sys.modules['numpy'].ascontiguousarray(rowHashes)), digest_size=16).hexdigest()
+
+        def fits(self, name, mimeType, value, kind):
+            # objects whose response was too large once are not versioned again, others are checked
+            # against a lower bound of the encoded size, records repeat every column name in every row
+            with self.__lock:
+                oversized = self.__oversized.get((name, mimeType))
+            if (oversized is not None and oversized() is value):
+                return False
+            try:
+                if (kind == 'dataframe'):
+                    return len(value) * sum(len(str(column)) + 4 for column in value.columns) <= self.__max_bytes
+                if (kind in ['series', 'ndarray']):
+                    return value.size * 2 <= self.__max_bytes
+            except Exception:
+                return False
+            return True
+
+        @staticmethod
+        def etag(version):
+            return hashlib.blake2b(repr(version).encode('utf-8'), digest_size=12).hexdigest()
+
+        def get(self, name, mimeType, value, version):
+            with self.__lock:
+                entry = self.__entries.get((name, mimeType))
+                if (entry is None or entry[0] != version or (entry[1] is not None and entry[1]() is not value)):
+                    return None
+                self.__entries.move_to_end((name, mimeType))
+                return entry[2]
+
+        def put(self, name, mimeType, value, version, response, size):
+            try:
+                ref = weakref.ref(value)
+            except TypeError:
+                ref = None
+            with self.__lock:
+                if (size > self.__max_bytes):
+                    if (ref is not None):
+                        self.__oversized[(name, mimeType)] = ref
+                    return
+                self.__remove((name, mimeType))
+                self.__entries[(name, mimeType)] = (version, ref, response, size)
+                self.__size += size
+                while (self.__size > self.__max_bytes):
+                    self.__remove(next(iter(self.__entries)))
+
+        def evict(self, name):
+            with self.__lock:
+                for key in [key for key in self.__entries if key[0] == name]:
+                    self.__remove(key)
+                for key in [key for key in self.__oversized if key[0] == name]:
+                    del self.__oversized[key]
+
+        def __remove(self, key):
+            entry = self.__entries.pop(key, None)
+            if (entry is not None):
+                self.__size -= entry[3]
+
+    class DeltaTracker:
+        # the last version of a value sent to the client is kept as hashes of its rows, columns or
+        # items so the next request can be answered with what changed since. a client that does not
+        # hold the last version, or a change the hashes can not describe, gets the whole value again.
+        __max_values = 32
+
+        def __init__(self):
+            self.__lock = threading.Lock()
+            self.__sent = collections.OrderedDict()
+            self.__versions = itertools.count(1)
+
+        def delta(self, name, value, kind, baseVersion):
+            with self.__lock:
+                entry = self.__sent.get(name)
+            base = entry[1] if entry is not None and baseVersion is not None and entry[0] == baseVersion else None
+
+            snapshot, change = None, None
+            if (kind == 'dataframe'):
+                snapshot, change = self.__track_dataframe(value, base)
+            elif (isinstance(value, (list, tuple))):
+                snapshot, change = self.__track_sequence(value, base)
+            elif (isinstance(value, dict)):
+                snapshot, change = self.__track_mapping(value, base)
+
+            if (change is None):
+                operation, changes, baseVersion = 'replace', { 'value': value }, None
+            else:
+                operation, changes = change
+            version = baseVersion if operation == 'unchanged' else next(self.__versions)
+
+            with self.__lock:
+                self.__sent.pop(name, None)
+                if (snapshot is not None):
+                    self.__sent[name] = (version, snapshot)
+                    while (len(self.__sent) > self.__max_values):
+                        self.__sent.popitem(last=False)
+            return version, baseVersion, operation, changes
+
+        def __track_dataframe(self, value, base):
+            pd = sys.modules['pandas']
+            columns = [str(column) for column in value.columns]
+            if (len(set(columns)) != len(columns)):
+                return None, None
+
+            rowHashes = pd.util.hash_pandas_object(value, index=True).to_numpy()
+            snapshot = {
+                'kind': 'dataframe',
+                'length': len(value),
+                'rows': self.__digest(rowHashes),
+                'index': self.__digest(pd.util.hash_pandas_object(value.index).to_numpy()),
+                'dtypes': [str(dtype) for dtype in value.dtypes],
+                'columns': { column: self.__digest(pd.util.hash_pandas_object(value.iloc[:, i], index=False).to_numpy(), str(value.dtypes.iloc[i]))
+                    for i, column in enumerate(columns) }
+            }
+            if (base is None or base['kind'] != 'dataframe'):
+                return snapshot, None
+
+            # rows were only appended when the known rows hash the same and the columns did not change
+            length = base['length']
+            if (list(base['columns']) == columns and base['dtypes'] == snapshot['dtypes'] and len(value) >= length and self.__digest(rowHashes[:length]) == base['rows']):
+                if (len(value) == length):
+                    return snapshot, ('unchanged', {})
+                return snapshot, ('append', { 'rows': value.iloc[length:] })
+
+            # with the same rows only the columns whose values changed are sent
+            if (base['index'] == snapshot['index']):
+                changed = { column: value.iloc[:, i] for i, column in enumerate(columns) if base['columns'].get(column) != snapshot['columns'][column] }
+                if (len(changed) < len(columns)):
+                    removed = [column for column in base['columns'] if column not in snapshot['columns']]
+                    return snapshot, ('update', { 'columns': changed, 'removedColumns': removed, 'columnOrder': columns })
+            return snapshot, None
+
+        def __track_sequence(self, value, base):
+            hashes = array.array('q', [self.__item_hash(item) for item in value])
+            snapshot = { 'kind': 'sequence', 'items': hashes }
+            if (base is None or base['kind'] != 'sequence'):
+                return snapshot, None
+
+            known = base['items']
+            if (len(hashes) >= len(known) and hashes[:len(known)] == known):
+                if (len(hashes) == len(known)):
+                    return snapshot, ('unchanged', {})
+                return snapshot, ('append', { 'items': list(value[len(known):]) })
+
+            if (len(hashes) == len(known)):
+                indices = [i for i, (old, new) in enumerate(zip(known, hashes)) if old != new]
+                if (len(indices) <= len(hashes) // 2):
+                    return snapshot, ('update', { 'indices': indices, 'items': [value[i] for i in indices] })
+            return snapshot, None
+
+        def __track_mapping(self, value, base):
+            hashes = { key: self.__item_hash(item) for key, item in value.items() }
+            snapshot = { 'kind': 'mapping', 'items': hashes }
+            if (base is None or base['kind'] != 'mapping'):
+                return snapshot, None
+
+            known = base['items']
+            changed = { key: value[key] for key, itemHash in hashes.items() if key not in known or known[key] != itemHash }
+            removed = [key for key in known if key not in hashes]
+            if (not changed and not removed):
+                return snapshot, ('unchanged', {})
+            return snapshot, ('update', { 'set': changed, 'removed': removed })
+
+        @staticmethod
+        def __item_hash(item):
+            # items are digested by content, hash() collides for scalars such as -1 and -2 and depends
+            # on identity for NaN. scalars are digested through their repr, anything else through its json
+            itemType = type(item)
+            if (itemType in [int, float, str, bool, bytes, type(None)]):
+                text = f'{itemType.__name__}:{item!r}'
+            else:
+                text = Envelope.encoder.dumps(item)
+            digest = hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=8).digest()
+            return int.from_bytes(digest, 'little', signed=True)
+
+        @staticmethod
+        def __digest(hashes, salt = ''):
+            digest = hashlib.blake2b(memoryview(hashes), digest_size=16)
+            digest.update(salt.encode('utf-8'))
+            return digest.hexdigest()
+
+    class ValueSummarizer:
+        # summaries only ever look at a bounded part of the value so their cost does not
+        # depend on the size of the data. the summary is registered for the kind of the value.
+        def __init__(self, types, maxLength = 500, maxItems = 10):
+            self.__types = types
+            summarizers = {
+                'scalar': lambda value: f'{value}',
+                'text': lambda value: self.__truncate(value if isinstance(value, str) else repr(value[:self.__max_length + 1])),
+                'collection': self.__summarize_collection,
+                'ndarray': self.__summarize_ndarray,
+                'series': lambda value: value.to_string(max_rows=self.__max_items, length=True, dtype=True),
+                'dataframe': lambda value: value.to_string(max_rows=self.__max_items, max_cols=self.__max_items, show_dimensions='truncate'),
+                'polars.dataframe': lambda value: f'{value.head(self.__max_items)}',
+                'arrow.table': lambda value: value.slice(0, self.__max_items).to_string(preview_cols=self.__max_items)
+            }
+            for kind, summarizer in summarizers.items():
+                types.register_summarizer(kind, summarizer)
+            self.__max_length = maxLength
+            self.__max_items = maxItems
+            self.__repr = reprlib.Repr()
+            self.__repr.maxlevel = 2
+            self.__repr.maxlist = self.__repr.maxtuple = self.__repr.maxdict = maxItems
+            self.__repr.maxset = self.__repr.maxfrozenset = self.__repr.maxdeque = maxItems
+            self.__repr.maxstring = self.__repr.maxother = maxLength
+
+        def summarize(self, value):
+            summarizer = self.__types.summarizer(self.__types.kind(value))
+            if (summarizer is None):
+                # other values are shown as text, only the containers reprlib knows are read through it
+                summarizer = self.__repr.repr if type(value) in (collections.deque, array.array) else str
+            return self.__truncate(summarizer(value))
+
+        def placeholder(self, value):
+            try:
+                return f'{type(value).__name__} ({len(value)} items)'
+            except Exception:
+                return type(value).__name__
+
+        def __summarize_ndarray(self, value):
+            items = sys.modules['numpy'].array2string(value, threshold=self.__max_items, edgeitems=min(3, self.__max_items))
+            return f'{items} shape={value.shape} dtype={value.dtype}'
+
+        def __summarize_collection(self, value):
+            # reprlib picks its method by type name and would repr subclasses such as Counter in full, only
+            # the first items are read instead. named tuples have a fixed number of fields and keep their repr
+            if (hasattr(value, '_fields')):
+                return self.__repr.repr(value)
+            level = self.__repr.maxlevel - 1
+            if (isinstance(value, dict)):
+                items = [f'{self.__repr.repr1(key, level)}: {self.__repr.repr1(item, level)}' for key, item in itertools.islice(value.items(), self.__max_items)]
+                brackets = '{}'
+            else:
+                items = [self.__repr.repr1(item, level) for item in itertools.islice(value, self.__max_items)]
+                brackets = '[]' if isinstance(value, list) else '()' if isinstance(value, tuple) else '{}'
+            if (len(value) > self.__max_items):
+                items.append('...')
+            elif (isinstance(value, tuple) and len(items) == 1):
+                items[0] += ','
+
+            text = brackets[0] + ', '.join(items) + brackets[1] if items or not isinstance(value, (set, frozenset)) else ''
+            if (type(value) not in (list, tuple, dict, set) or not text):
+                text = f'{type(value).__name__}({text})'
+            return text if len(value) <= self.__max_items else f'{text} ({len(value)} items)'
+
+        def __truncate(self, text):
+            return text if len(text) <= self.__max_length else text[:self.__max_length] + '...'
+
+    class ValueStream:
+        __default_window = 4
+        __rows_per_slice = 1000
+
+        def __init__(self, name, chunks, formattedValue, command, window = None):
+            self.name = name
+            self.formattedValue = formattedValue
+            self.command = command
+            self.completed = False
+            self.__chunks = chunks
+            self.__window = window if isinstance(window, int) and window > 0 else self.__default_window
+            self.__sent = 0
+            self.__acknowledged = 0
+
+        def acknowledge(self, sequence):
+            self.__acknowledged = max(self.__acknowledged, min(sequence + 1, self.__sent))
+
+        def next_envelops(self):
+            envelops = []
+            while (not self.completed and self.__sent - self.__acknowledged < self.__window):
+                chunk = next(self.__chunks, None)
+                if (chunk is None):
+                    self.completed = True
+                    envelops.append(EventEnvelope(ValueStreamCompleted(self.name, self.__sent, self.formattedValue), self.command))
+                else:
+                    envelops.append(EventEnvelope(ValueChunkProduced(self.name, self.__sent, chunk), self.command))
+                    self.__sent += 1
+            return envelops
+
+        def close(self):
+            self.completed = True
+            self.__chunks.close()
+
+        @staticmethod
+        def json_pieces(value, kind = None):
+            # dataframes, series and arrays are encoded a slice of rows at a time so only one slice is held as lists
+            if (kind not in ('dataframe', 'series', 'ndarray') or value.ndim == 0):
+                yield from Envelope.encoder.iterencode(value)
+                return
+
+            sliced = value if kind == 'ndarray' else value.iloc
+            yield '['
+            separator = ''
+            for start in range(0, len(value), ValueStream.__rows_per_slice):
+                rows = Envelope.encoder.dumps(sliced[start:start + ValueStream.__rows_per_slice])[1:-1]
+                yield separator + rows
+                separator = ','
+            yield ']'
+
+        @staticmethod
+        def chunks(pieces, chunkSize):
+            pending = []
+            pendingSize = 0
+            for piece in pieces:
+                while (pendingSize + len(piece) >= chunkSize):
+                    split = chunkSize - pendingSize
+                    pending.append(piece[:split])
+                    yield ''.join(pending)
+                    piece = piece[split:]
+                    pending = []
+                    pendingSize = 0
+                if (piece):
+                    pending.append(piece)
+                    pendingSize += len(piece)
+            if (pending):
+                yield ''.join(pending)
+            
+    class Histogram:
+        # samples are counted in buckets with fixed upper bounds, percentiles are read as the
+        # bound of the bucket they fall into and the overflow bucket reports the largest sample.
+        def __init__(self, bounds):
+            self.__bounds = bounds
+            self.__buckets = [0] * (len(bounds) + 1)
+            self.count = 0
+            self.total = 0
+            self.max = 0
+
+        def add(self, value):
+            self.__buckets[bisect.bisect_left(self.__bounds, value)] += 1
+            self.count += 1
+            self.total += value
+            self.max = max(self.max, value)
+
+        def percentile(self, p):
+            if (self.count == 0):
+                return None
+            rank = max(math.ceil(self.count * p), 1)
+            seen = 0
+            for i, count in enumerate(self.__buckets):
+                seen += count
+                if (seen >= rank):
+                    return self.__bounds[i] if i < len(self.__bounds) else self.max
+            return self.max
+
+        def snapshot(self):
+            return {
+                'count': self.count,
+                'sum': self.total,
+                'max': self.max,
+                'p50': self.percentile(0.5),
+                'p90': self.percentile(0.9),
+                'p99': self.percentile(0.99),
+                'buckets': [{ 'le': self.__bounds[i] if i < len(self.__bounds) else None, 'count': count }
+                    for i, count in enumerate(self.__buckets) if count > 0]
+            }
+
+    class HandlerMetrics:
+        # per command type counts, errors, phase latencies in milliseconds and payload sizes in bytes.
+        # the command a thread is working on is bound to the thread so that the replies it sends
+        # are attributed to it.
+        __latency_bounds = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+        __size_bounds = [2 ** i for i in range(10, 30, 2)]
+        __max_log_entries = 100
+
+        def __init__(self):
+            self.__lock = threading.Lock()
+            self.__bound = threading.local()
+            self.reset()
+
+        def reset(self):
+            with self.__lock:
+                self.__commands = {}
+                self.__value_types = {}
+                self.__log = collections.deque(maxlen=self.__max_log_entries)
+
+        def bind(self, commandType):
+            self.__bound.commandType = commandType
+
+        def count(self):
+            with self.__lock:
+                self.__command()['count'] += 1
+
+        def error(self):
+            with self.__lock:
+                self.__command()['errors'] += 1
+
+        def observe(self, phase, seconds):
+            with self.__lock:
+                phases = self.__command()['phases']
+                if (phase not in phases):
+                    phases[phase] = Histogram(self.__latency_bounds)
+                phases[phase].add(seconds * 1000)
+
+        def observe_payload(self, size):
+            with self.__lock:
+                self.__command()['payloadBytes'].add(size)
+
+        def observe_value(self, valueType, seconds):
+            typeName = f'{valueType.__module__}.{valueType.__qualname__}'
+            with self.__lock:
+                if (typeName not in self.__value_types):
+                    self.__value_types[typeName] = Histogram(self.__latency_bounds)
+                self.__value_types[typeName].add(seconds * 1000)
+
+        def log(self, source, message):
+            with self.__lock:
+                self.__log.append({
+                    'time': time.time(),
+                    'commandType': getattr(self.__bound, 'commandType', None),
+                    'source': str(source),
+                    'message': message if isinstance(message, str) else repr(message)
+                })
+
+        def snapshot(self):
+            with self.__lock:
+                return {
+                    'commands': { commandType: {
+                        'count': entry['count'],
+                        'errors': entry['errors'],
+                        'phases': { phase: histogram.snapshot() for phase, histogram in entry['phases'].items() },
+                        'payloadBytes': entry['payloadBytes'].snapshot()
+                    } for commandType, entry in self.__commands.items() },
+                    'valueTypes': { typeName: histogram.snapshot() for typeName, histogram in self.__value_types.items() },
+                    'log': list(self.__log)
+                }
+
+        def __command(self):
+            commandType = getattr(self.__bound, 'commandType', None) or 'unknown'
+            if (commandType not in self.__commands):
+                self.__commands[commandType] = { 'count': 0, 'errors': 0, 'phases': {}, 'payloadBytes': Histogram(self.__size_bounds) }
+            return self.__commands[commandType]
+            
+    class ValuePage:
+        # rows of tables, items of sequences and mappings and characters of text can be paged,
+        # columns can only be selected from tables.
+        @staticmethod
+        def slice(value, kind, offset, limit, columns = None):
+            if (kind == 'dataframe'):
+                page = value.iloc[offset:offset + limit]
+                return (page if columns is None else page[columns]), len(value)
+            if (kind == 'polars.dataframe'):
+                page = value.slice(offset, limit)
+                return (page if columns is None else page.select(columns)), value.height
+            if (kind == 'arrow.table'):
+                page = value.slice(offset, limit)
+                return (page if columns is None else page.select(columns)), value.num_rows
+
+            if (columns is not None):
+                raise TypeError(f'Columns can not be selected from values of type {type(value).__name__}.')
+            if (kind == 'series'):
+                return value.iloc[offset:offset + limit], len(value)
+            if (kind in ['ndarray', 'text'] or isinstance(value, (list, tuple))):
+                return value[offset:offset + limit], len(value)
+            if (isinstance(value, dict)):
+                return dict(itertools.islice(value.items(), offset, offset + limit)), len(value)
+            if (kind == 'collection'):
+                return list(itertools.islice(value, offset, offset + limit)), len(value)
+            raise TypeError(f'Values of type {type(value).__name__} can not be paged.')
+
+    class TypedArrays:
+        # numeric values travel as the raw bytes of numpy arrays described by their dtype and shape,
+        # tables as one array per column. comm buffers and shared memory segments share this layout,
+        # a descriptor's kind is 'ndarray' for a single array and 'dataframe' for a table.
+        mimeType = 'application/vnd.dotnet-interactive.typed-buffers+json'
+        __fixed_size_kinds = 'biufcmM'
+
+        @staticmethod
+        def from_value(value, kind):
+            if (kind == 'ndarray'):
+                arrays = [(None, value)]
+            elif (kind == 'dataframe'):
+                arrays = [(str(column), value.iloc[:, i].to_numpy()) for i, column in enumerate(value.columns)]
+            elif (kind == 'polars.dataframe'):
+                arrays = [(series.name, series.to_numpy()) for series in value.get_columns()]
+            elif (kind == 'arrow.table'):
+                arrays = [(name, column.to_numpy()) for name, column in zip(value.column_names, value.columns)]
+            else:
+                raise TypeError('Only numpy arrays and pandas, polars or pyarrow tables are supported.')
+
+            for name, array in arrays:
+                if (array.dtype.kind not in TypedArrays.__fixed_size_kinds):
+                    raise TypeError(f'"{name or "array"}" of type {array.dtype} has no fixed size layout.')
+            return ('ndarray' if kind == 'ndarray' else 'dataframe'), arrays
+
+        @staticmethod
+        def to_value(kind, arrays, targetType = None):
+            # tables become pandas dataframes unless the sender asks for polars or pyarrow
+            if (kind != 'dataframe'):
+                return arrays[0][1]
+            if (targetType == 'polars'):
+                import polars as pl
+                return pl.DataFrame(dict(arrays))
+            if (targetType == 'pyarrow'):
+                import pyarrow as pa
+                return pa.table(dict(arrays))
+            import pandas as pd
+            return pd.DataFrame(dict(arrays), copy=False)
+
+        @staticmethod
+        def to_buffers(kind, arrays):
+            import numpy as np
+            layout = []
+            buffers = []
+            for name, array in arrays:
+                layout.append({ 'name': name, 'dtype': array.dtype.str, 'shape': list(array.shape), 'bufferIndex': len(buffers) })
+                buffers.append(memoryview(np.ascontiguousarray(array).reshape(-1).view(np.uint8)))
+            return { 'kind': kind, 'arrays': layout }, buffers
+
+        @staticmethod
+        def from_buffers(descriptor, buffers, targetType = None):
+            import numpy as np
+            arrays = [(entry.get('name'), np.frombuffer(buffers[entry['bufferIndex']], dtype=np.dtype(entry['dtype'])).reshape(entry['shape']).copy())
+                for entry in descriptor['arrays']]
+            return TypedArrays.to_value(descriptor.get('kind'), arrays, targetType)
+
+        @staticmethod
+        def rebase(descriptor, bufferOffset):
+            return dict(descriptor, arrays=[dict(entry, bufferIndex=entry['bufferIndex'] + bufferOffset) for entry in descriptor['arrays']])
+
+    class SharedMemoryTransport:
+        # numpy arrays and table columns are copied into a shared memory segment owned by the
+        # handler, only the segment name and the layout of the arrays travel over the comm. segments
+        # live until they are released, until too many are alive or until the comm is closed.
+        mimeType = 'application/vnd.dotnet-interactive.shared-memory+json'
+        __max_segments = 8
+        __alignment = 64
+
+        def __init__(self):
+            self.__lock = threading.Lock()
+            self.__segments = {}
+
+        def export(self, value, kind):
+            import numpy as np
+            from multiprocessing import shared_memory
+            kind, arrays = TypedArrays.from_value(value, kind)
+
+            layout = []
+            size = 0
+            for name, array in arrays:
+                offset = -(-size // self.__alignment) * self.__alignment
+                layout.append({ 'name': name, 'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset })
+                size = offset + array.nbytes
+
+            segment = shared_memory.SharedMemory(create=True, size=max(size, 1))
+            for (_, array), entry in zip(arrays, layout):
+                np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf, offset=entry['offset'])[...] = array
+
+            with self.__lock:
+                self.__segments[segment.name] = segment
+                while (len(self.__segments) > self.__max_segments):
+                    self.__unlink(self.__segments.pop(next(iter(self.__segments))))
+
+            return { 'segment': segment.name, 'size': segment.size, 'kind': kind, 'arrays': layout }
+
+        def release(self, segmentName):
+            with self.__lock:
+                segment = self.__segments.pop(segmentName, None)
+            if (segment is None):
+                return False
+            self.__unlink(segment)
+            return True
+
+        def release_all(self):
+            with self.__lock:
+                segments = list(self.__segments.values())
+                self.__segments.clear()
+            for segment in segments:
+                self.__unlink(segment)
+
+        @staticmethod
+        def read(descriptor, targetType = None):
+            # the segment belongs to the sender, so the arrays are copied out before it is detached
+            import numpy as np
+            segment = SharedMemoryTransport.__attach(descriptor['segment'])
+            try:
+                arrays = [(entry.get('name'), np.ndarray(tuple(entry['shape']), dtype=np.dtype(entry['dtype']), buffer=segment.buf, offset=entry['offset']).copy())
+                    for entry in descriptor['arrays']]
+            finally:
+                segment.close()
+
+            return TypedArrays.to_value(descriptor.get('kind'), arrays, targetType)
+
+        @staticmethod
+        def __attach(segmentName):
+            from multiprocessing import shared_memory
+            try:
+                return shared_memory.SharedMemory(name=segmentName, track=False)
+            except TypeError:
+                # before python 3.13 attaching registers the segment for unlinking when this process exits
+                from multiprocessing import resource_tracker
+                segment = shared_memory.SharedMemory(name=segmentName)
+                resource_tracker.unregister(segment._name, 'shared_memory')
+                return segment
+
+        @staticmethod
+        def __unlink(segment):
+            segment.close()
+            segment.unlink()
+            
+    class PayloadCompression:
+        # payloads over the threshold are sent compressed as the last binary buffer of the
+        # comm message, the json part only says which codec and buffer hold them.
+        __default_threshold = 65536
+
+        def __init__(self, codec, compress, threshold = None):
+            self.codec = codec
+            self.threshold = threshold if isinstance(threshold, int) and threshold >= 0 else self.__default_threshold
+            self.__compress = compress
+
+        @staticmethod
+        def negotiate(codecs, threshold = None):
+            for codec in codecs or []:
+                compress = PayloadCompression.__get_compress(codec)
+                if (compress is not None):
+                    return PayloadCompression(codec, compress, threshold)
+            return None
+
+        def capabilities(self):
+            return { 'compression': self.codec, 'compressionThreshold': self.threshold }
+
+        def compress(self, payload, buffers):
+            text = payload.get('commandOrEvent')
+            if (text is None or len(text) < self.threshold):
+                return payload, buffers
+
+            compressed = self.__compress(text.encode('utf-8'))
+            payload = dict(payload, commandOrEvent=None, compression={ 'codec': self.codec, 'bufferIndex': len(buffers) })
+            return payload, list(buffers) + [compressed]
+
+        @staticmethod
+        def __get_compress(codec):
+            try:
+                if (codec == 'zlib'):
+                    import zlib
+                    return lambda data: zlib.compress(data, 1)
+                if (codec == 'gzip'):
+                    import gzip
+                    return lambda data: gzip.compress(data, 1)
+                if (codec == 'zstd'):
+                    import zstandard
+                    # compressors are not safe to share between the threads sending replies
+                    return lambda data: zstandard.ZstdCompressor(level=3).compress(data)
+                if (codec == 'lz4'):
+                    import lz4.frame
+                    return lz4.frame.compress
+            except ImportError:
+                pass
+            return None
+
+    class TabularDataResourceReader:
+        # columns are built straight from the schema fields with one typed numpy conversion per
+        # column, instead of letting pandas infer the type of every row.
+        @staticmethod
+        def to_dataframe(resource):
+            import pandas as pd
+            data = resource['data']
+            fields = (resource.get('schema') or {}).get('fields')
+            if (not fields):
+                return pd.DataFrame(data=data)
+
+            columns = {}
+            for field in fields:
+                name = field['name']
+                values = list(map(operator.methodcaller('get', name), data))
+                columns[name] = TabularDataResourceReader.__to_column(values, field)
+
+            return pd.DataFrame(columns, copy=False)
+
+        @staticmethod
+        def __to_column(values, field):
+            import numpy as np
+            import pandas as pd
+            fieldType = field.get('type')
+            enum = (field.get('constraints') or {}).get('enum')
+            # numpy and pandas convert strings, bools and fractions into the declared type, so the json
+            # types are checked first. values that do not match their declared type are kept as they are
+            types = set(map(type, values))
+            nullable = type(None) in types
+            types.discard(type(None))
+            try:
+                if (enum is not None):
+                    if (set(values) <= set(enum) | {None}):
+                        return pd.Categorical(values, categories=enum)
+                elif (fieldType == 'integer' and types <= {int}):
+                    return pd.array(values, dtype='Int64') if nullable else np.fromiter(values, dtype=np.int64, count=len(values))
+                elif (fieldType == 'number' and types <= {int, float}):
+                    return np.array(values, dtype=np.float64)
+                elif (fieldType == 'boolean' and types <= {bool}):
+                    return pd.array(values, dtype='boolean') if nullable else np.array(values, dtype=np.bool_)
+                elif (fieldType in ('datetime', 'date') and types <= {str}):
+                    return pd.to_datetime(values, format='ISO8601')
+            except (TypeError, ValueError, OverflowError):
+                pass
+            return values
+
+    class FormattedValue(Message):
+        __slots__ = ('mimeType', 'value')
+
         def __init__(self, mimeType = 'application/json', value = None):
             self.mimeType = mimeType
             self.value = value
         
         @staticmethod
-        def fromValue(value, mimeType = 'application/json'):
+        def fromValue(value, mimeType = 'application/json', kind = None):
             formattedValue = None
-            try: 
-                import pandas as pd; 
-                if (isinstance(value, pd.DataFrame)):
-                    mimeType = 'application/table-schema+json'
-            except Exception: 
-                pass
+            if (kind == 'dataframe'):
+                mimeType = 'application/table-schema+json'
 
             if (mimeType == 'application/json'):
-                import json; formattedValue = json.dumps(value)
+                formattedValue = Envelope.encoder.dumps(value)
             elif (mimeType == 'application/table-schema+json'):
                 formattedValue = value.to_string(index=False, max_rows=5)
 
             return FormattedValue(mimeType, formattedValue)
 
-    class KernelValueInfo:
+    class KernelValueInfo(Message):
+        __slots__ = ('name', 'formattedValue', 'typeName')
+
         def __init__(self, name, formattedValue: FormattedValue, typeName = None):
             self.name = name
             self.formattedValue = formattedValue
             self.typeName = typeName
         
-    class KernelEvent:
-        pass
+    class KernelEvent(Message):
+        __slots__ = ()
 
     class KernelReady(KernelEvent):
-        def __init__(self, kernelInfos = []):
+        __slots__ = ('kernelInfos', 'capabilities')
+        optional = ('capabilities',)
+
+        def __init__(self, kernelInfos = [], capabilities = None):
             self.kernelInfos = kernelInfos
+            self.capabilities = capabilities
 
     class CommandSucceeded(KernelEvent):
-        pass
+        __slots__ = ()
 
     class CommandFailed(KernelEvent):
+        __slots__ = ('message',)
+
         def __init__(self, message = None):
             self.message = message
 
     class ValueProduced(KernelEvent):
+        # the etag is only sent to clients that asked for one
+        __slots__ = ('name', 'value', 'formattedValue', 'etag')
+        optional = ('etag',)
+
         def __init__(self, name, value, formattedValue: FormattedValue):
             self.name = name
             self.value = value 
             self.formattedValue = formattedValue
+            self.etag = None
     
+    class DiagnosticsProduced(KernelEvent):
+        __slots__ = ('commands', 'valueTypes', 'log')
+
+        def __init__(self, commands, valueTypes, log):
+            self.commands = commands
+            self.valueTypes = valueTypes
+            self.log = log
+
+    class ValuesProduced(KernelEvent):
+        __slots__ = ('values',)
+
+        def __init__(self, values):
+            self.values = values
+
+    class ValueDeltaProduced(KernelEvent):
+        __slots__ = ('name', 'version', 'baseVersion', 'operation', 'changes')
+
+        def __init__(self, name, version, baseVersion, operation, changes):
+            self.name = name
+            self.version = version
+            self.baseVersion = baseVersion
+            self.operation = operation
+            self.changes = changes
+
+    class ValueUnchanged(KernelEvent):
+        __slots__ = ('name', 'etag')
+
+        def __init__(self, name, etag):
+            self.name = name
+            self.etag = etag
+
+    class ValuePageProduced(ValueProduced):
+        __slots__ = ('offset', 'totalCount')
+
+        def __init__(self, name, value, formattedValue: FormattedValue, offset, totalCount):
+            super().__init__(name, value, formattedValue)
+            self.offset = offset
+            self.totalCount = totalCount
+
+    class ValueChunkProduced(KernelEvent):
+        __slots__ = ('name', 'sequence', 'chunk')
+
+        def __init__(self, name, sequence, chunk):
+            self.name = name
+            self.sequence = sequence
+            self.chunk = chunk
+
+    class ValueStreamCompleted(KernelEvent):
+        __slots__ = ('name', 'chunkCount', 'formattedValue')
+
+        def __init__(self, name, chunkCount, formattedValue: FormattedValue):
+            self.name = name
+            self.chunkCount = chunkCount
+            self.formattedValue = formattedValue
+
     class ValueInfosProduced(KernelEvent):
-        def __init__(self, valueInfos):
+        # only incremental replies carry the generation they are based on
+        __slots__ = ('valueInfos', 'generation', 'removedNames')
+        optional = ('generation', 'removedNames')
+
+        def __init__(self, valueInfos, generation = None, removedNames = None):
             self.valueInfos = valueInfos
+            self.generation = generation
+            self.removedNames = removedNames
             
-    class Envelope:
-        def payload(self):
-            return { 'commandOrEvent': self.__to_json_string(self) }
+    class ValueInfosChanged(KernelEvent):
+        __slots__ = ('valueInfos', 'generation', 'removedNames')
+
+        def __init__(self, valueInfos, generation, removedNames):
+            self.valueInfos = valueInfos
+            self.generation = generation
+            self.removedNames = removedNames
+
+    class RawJson:
+        # json text produced by a vectorized encoder that is written into the payload as is
+        __slots__ = ('text',)
+
+        def __init__(self, text):
+            self.text = text
 
         @staticmethod
-        def __to_json_string(obj):
-            return json.dumps(obj, default=lambda o: o.__dict__)
+        def array(items):
+            return RawJson('[' + ','.join([item.text for item in items]) + ']')
+
+    class JsonEncoder:
+        # values json can not encode natively are converted by the serializer their type is registered
+        # with in the value type registry. orjson is used when it is installed.
+        __rows_per_slice = 65536
+
+        def __init__(self):
+            self.types = ValueTypeRegistry(self)
+            self.__message_converters = {}
+            self.__backend = None
+            self.__marker = f'raw-json-{uuid.uuid4().hex}-'
+            self.__marker_pattern = re.compile(f'"{self.__marker}(\\d+)"')
+            self.__non_finite_pattern = re.compile('(-?Infinity|NaN)$')
+
+        def convert(self, value):
+            if (isinstance(value, RawJson)):
+                return value
+            valueType = type(value)
+            if (issubclass(valueType, Message)):
+                converter = self.__message_converters.get(valueType)
+                if (converter is None):
+                    converter = self.__message_converters[valueType] = self.__message_converter(valueType)
+            else:
+                converter = self.types.serializer(valueType)
+            if (converter is not None):
+                return converter(value)
+            if (hasattr(value, '__dict__')):
+                return value.__dict__
+            raise TypeError(f'Object of type {valueType.__name__} is not JSON serializable')
+
+        def dumps(self, value):
+            fragments = []
+            def default(o):
+                converted = self.convert(o)
+                if (isinstance(converted, RawJson)):
+                    fragments.append(converted.text)
+                    return f'{self.__marker}{len(fragments) - 1}'
+                return converted
+
+            text = None
+            backend = self.__get_backend()
+            if (backend is not None):
+                try:
+                    text = backend.dumps(value, default=default, option=backend.OPT_SERIALIZE_NUMPY | backend.OPT_NON_STR_KEYS).decode('utf-8')
+                except backend.JSONEncodeError:
+                    # orjson rejects values json encodes, such as integers past 64 bits, tuple subclasses,
+                    # lone surrogates and deep nesting, those are written by json instead
+                    fragments.clear()
+            if (text is None):
+                try:
+                    text = json.dumps(value, default=default, allow_nan=False)
+                except ValueError:
+                    # NaN and infinity are not valid json, they are written as null like the other encoders do
+                    fragments.clear()
+                    text = json.dumps(self.__without_nan(value), default=default)
+
+            if (not fragments):
+                return text
+            return self.__marker_pattern.sub(lambda match: fragments[int(match.group(1))], text)
+
+        def iterencode(self, value):
+            # the value is walked as it is written. every float and every converted value is a chunk of its
+            # own, so NaN and infinity are replaced and raw json is spliced in one chunk at a time
+            fragments = {}
+            def default(o):
+                converted = self.convert(o)
+                if (isinstance(converted, RawJson)):
+                    fragments[len(fragments)] = converted.text
+                    return f'{self.__marker}{len(fragments) - 1}'
+                return converted
+
+            for chunk in json.JSONEncoder(default=default).iterencode(value):
+                if (chunk.endswith(('NaN', 'Infinity'))):
+                    chunk = self.__non_finite_pattern.sub('null', chunk)
+                elif (fragments and self.__marker in chunk):
+                    chunk = self.__marker_pattern.sub(lambda match: fragments.pop(int(match.group(1))), chunk)
+                yield chunk
+
+        def __get_backend(self):
+            if (self.__backend is None):
+                try:
+                    import orjson
+                    self.__backend = orjson
+                except ImportError:
+                    self.__backend = False
+            return self.__backend or None
+
+        @staticmethod
+        def __message_converter(messageType):
+            # required fields are read in one attrgetter call, optional ones are only written when set
+            fields = messageType.fields()
+            required = tuple(name for name in fields if name not in messageType.optional)
+            optional = tuple(name for name in fields if name in messageType.optional)
+            if (len(required) > 1):
+                read = operator.attrgetter(*required)
+            elif (required):
+                read = lambda value, get=operator.attrgetter(required[0]): (get(value),)
+            else:
+                read = lambda value: ()
+
+            def convert(value):
+                converted = dict(zip(required, read(value)))
+                for name in optional:
+                    field = getattr(value, name)
+                    if (field is not None):
+                        converted[name] = field
+                return converted
+            return convert
+
+        def __without_nan(self, value):
+            if (isinstance(value, float)):
+                return value if math.isfinite(value) else None
+            if (isinstance(value, dict)):
+                return { k: self.__without_nan(v) for k, v in value.items() }
+            if (isinstance(value, (list, tuple))):
+                return [self.__without_nan(v) for v in value]
+            return value
+
+        def convert_series(self, value):
+            if (value.dtype.kind == 'f'):
+                return self.convert_ndarray(value.to_numpy(dtype='float64', na_value=float('nan')))
+            return RawJson('[' + ','.join(self.__column_tokens(value)) + ']')
+
+        def convert_dataframe(self, value):
+            # to_json rounds floats to 10 decimals and at best 15, also the ones held in object columns.
+            # only frames of integers, booleans and dates are written by it, any other frame is written
+            # from the json tokens of each column so that every float keeps its exact value
+            if (all(dtype.kind in 'iubmM' for dtype in value.dtypes)):
+                return RawJson(value.to_json(orient='records', date_format='iso', default_handler=str))
+            row = '{' + ','.join(self.dumps(str(name)).replace('%', '%%') + ':%s' for name in value.columns) + '}'
+            rows = []
+            # tokens are only held for one slice of rows at a time
+            for start in range(0, len(value), self.__rows_per_slice):
+                frame = value.iloc[start:start + self.__rows_per_slice]
+                columns = [self.__column_tokens(frame.iloc[:, i]) for i in range(frame.shape[1])]
+                rows.append(','.join(map(row.__mod__, zip(*columns))))
+            return RawJson('[' + ','.join(rows) + ']')
+
+        def __column_tokens(self, column):
+            kind = column.dtype.kind
+            if (kind == 'f'):
+                return self.dumps(self.convert_ndarray(column.to_numpy(dtype='float64', na_value=float('nan'))))[1:-1].split(',')
+            if (kind in 'iubmM'):
+                # none of these tokens can hold a comma
+                return column.to_json(orient='values', date_format='iso', default_handler=str)[1:-1].split(',')
+
+            # strings repeat, every distinct one is encoded once. factorize takes 0 and False or 1 and 1.0
+            # for the same value, columns holding anything else are encoded item by item
+            np = sys.modules['numpy']
+            pd = sys.modules['pandas']
+            values = column.cat.categories if isinstance(column.dtype, pd.CategoricalDtype) else column
+            if (pd.api.types.infer_dtype(values, skipna=True) not in ('string', 'empty')):
+                return [self.dumps(item) for item in column.tolist()]
+            codes, uniques = pd.factorize(column)
+            tokens = np.array([self.dumps(unique) for unique in uniques] + ['null'], dtype=object)
+            return tokens[codes].tolist()
+
+        @staticmethod
+        def convert_ndarray(value):
+            np = sys.modules['numpy']
+            if (value.dtype.kind in 'fc'):
+                invalid = ~np.isfinite(value)
+                if (invalid.any()):
+                    value = value.astype(object)
+                    value[invalid] = None
+            elif (value.dtype.kind in 'mM'):
+                value = np.datetime_as_string(value) if value.dtype.kind == 'M' else value.astype(str)
+            return value.tolist()
+
+    class Envelope:
+        # binary buffers travel next to the json payload in the comm message, the envelope and
+        # its message are written in a single pass of the encoder
+        __slots__ = ('buffers',)
+        encoder = JsonEncoder()
+
+        def payload(self):
+            return { 'commandOrEvent': Envelope.encoder.dumps(self.fields()) }
 
     class EventEnvelope(Envelope):
-        def __init__(self, event: KernelEvent = None, command = None):
+        __slots__ = ('event', 'eventType', 'command')
+
+        def __init__(self, event: KernelEvent = None, command = None, buffers = None):
             self.event = event
             self.eventType = type(event).__name__
             self.command = command
+            self.buffers = [] if buffers is None else buffers
+
+        def fields(self):
+            return { 'event': self.event, 'eventType': self.eventType, 'command': self.command }
 
         def payload(self):
             ret = super().payload()